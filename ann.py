@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+
+
+def top_k(scores, k):
+    if len(scores) > k:
+        idx = np.argpartition(-scores, k)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx])]
+
+
+def kmeans(data, k, iters=15, seed=0, spherical=False):
+    # Plain Lloyd's k-means; `spherical` keeps centroids unit length so that
+    # assignment by dot product matches cosine similarity.
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iters):
+        if spherical:
+            assign = np.argmax(data @ centroids.T, axis=1)
+        else:
+            distances = (data ** 2).sum(1)[:, None] - 2 * data @ centroids.T + (centroids ** 2).sum(1)[None]
+            assign = np.argmin(distances, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(data[order], starts, axis=0) / counts[~empty, None]
+        # Re-seed empty clusters from random points
+        centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class IVFIndex:
+    # Inverted-file index over the unit vectors of one shard. Rows are
+    # clustered into `nlist` lists around k-means centroids and a query only
+    # scores the rows of its `nprobe` closest lists. With `pq_m > 0` each
+    # vector's residual from its centroid is also product-quantized into
+    # `pq_m` one-byte codes; list rows are then ranked by the PQ approximation
+    # and only the best `k * rerank` are re-scored exactly. Rows appended
+    # after training (`row >= trained`) are always scanned exactly and
+    # tombstoned rows score -inf, so the index stays correct between
+    # retrains as long as rows are not moved.
+    def __init__(self, nlist, nprobe=8, pq_m=0, rerank=16, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.seed = seed
+        self.trained = 0
+        self.centroids = None
+        self.rows = None  # row numbers grouped by list
+        self.offsets = None  # list i is rows[offsets[i]:offsets[i + 1]]
+        self.codebooks = None  # (pq_m, 256, dim // pq_m)
+        self.codes = None  # (trained, pq_m) uint8, by row number
+
+    def train(self, matrix, sample=256):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        valid = np.flatnonzero(np.isfinite(matrix[:, 0]))
+        rng = np.random.default_rng(self.seed)
+        nlist = max(1, min(self.nlist, len(valid)))
+        training = matrix[rng.choice(valid, size=min(len(valid), nlist * sample), replace=False)]
+        self.centroids = kmeans(training, nlist, seed=self.seed, spherical=True)
+
+        assign = np.full(len(matrix), nlist, dtype=np.int64)  # tombstones go nowhere
+        for start in range(0, len(valid), 65536):
+            block = valid[start:start + 65536]
+            assign[block] = np.argmax(matrix[block] @ self.centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist + 1)[:nlist]
+        self.rows = order[:counts.sum()]
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        if self.pq_m:
+            dim = matrix.shape[1]
+            sub = dim // self.pq_m
+            if sub * self.pq_m != dim:
+                raise ValueError(f"pq_m={self.pq_m} must divide the dimension {dim}")
+            training = training[:256 * 64]
+            residuals = training - self.centroids[np.argmax(training @ self.centroids.T, axis=1)]
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub:(j + 1) * sub], 256, seed=self.seed + j)
+                for j in range(self.pq_m)])
+            self.codes = np.zeros((len(matrix), self.pq_m), dtype=np.uint8)
+            for start in range(0, len(valid), 65536):
+                block = valid[start:start + 65536]
+                self.codes[block] = self.encode(matrix[block] - self.centroids[assign[block]])
+        self.trained = len(matrix)
+        return self
+
+    def encode(self, vectors):
+        sub = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            part = vectors[:, j * sub:(j + 1) * sub]
+            book = self.codebooks[j]
+            distances = (part ** 2).sum(1)[:, None] - 2 * part @ book.T + (book ** 2).sum(1)[None]
+            codes[:, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def search(self, matrix, query, k, nprobe=None):
+        """Returns (rows, scores) of the approximate top-k, best first, and
+        the number of rows that were scored."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        coarse = self.centroids @ query
+        lists = top_k(coarse, nprobe)
+        rows = np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+        tail = np.arange(self.trained, len(matrix))
+        scored = len(rows) + len(tail)
+        if self.pq_m and len(rows) > k * self.rerank:
+            sub = self.codebooks.shape[2]
+            tables = np.einsum("jcd,jd->jc", self.codebooks, query.reshape(self.pq_m, sub))
+            approx = tables[np.arange(self.pq_m), self.codes[rows]].sum(axis=1)
+            approx += np.repeat(coarse[lists], np.diff(self.offsets)[lists])
+            rows = rows[top_k(approx, k * self.rerank)]
+        rows = np.sort(np.concatenate([rows, tail]))
+        scores = np.nan_to_num(matrix[rows] @ query, nan=-np.inf)
+        best = top_k(scores, k)
+        return rows[best], scores[best], scored
+
+    def save(self, path, tag):
+        tmp = path + ".tmp.npz"
+        arrays = {"centroids": self.centroids, "rows": self.rows, "offsets": self.offsets,
+                  "params": np.array([self.nlist, self.nprobe, self.pq_m, self.rerank, self.trained]),
+                  "tag": np.array(tag)}
+        if self.pq_m:
+            arrays.update(codebooks=self.codebooks, codes=self.codes)
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, tag):
+        """Loads an index saved for the same shard `tag`, else returns None."""
+        try:
+            with np.load(path) as data:
+                if str(data["tag"]) != tag:
+                    return None
+                nlist, nprobe, pq_m, rerank, trained = (int(x) for x in data["params"])
+                index = cls(nlist, nprobe, pq_m, rerank)
+                index.centroids, index.rows, index.offsets = data["centroids"], data["rows"], data["offsets"]
+                if pq_m:
+                    index.codebooks, index.codes = data["codebooks"], data["codes"]
+                index.trained = trained
+                return index
+        except (OSError, KeyError, ValueError):
+            return None
@@ -1,75 +1,454 @@
-import os, requests, numpy as np, fitz, docx, re
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import os, pickle, random, threading, time, uuid, datetime, json, numpy as np, fitz, docx, re, httpx
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, flash, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from caches import EmbeddingCache, ResponseCache
+from http_client import CircuitOpenError, HttpClient
+from metrics import Registry, Tracer
+from vector_index import ShardStore, VectorIndex
 
 # Config
 load_dotenv()
 BASE = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(BASE, "uploads")
+VECTOR_FOLDER = os.path.join(BASE, "vectors")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key-123")
 app.config.update({
-    "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(BASE, "chatbot.db"),
+    "SQLALCHEMY_DATABASE_URI": os.getenv("DATABASE_URL", "sqlite:///" + os.path.join(BASE, "chatbot.db")),
     "SQLALCHEMY_TRACK_MODIFICATIONS": False,
     "UPLOAD_FOLDER": UPLOAD_FOLDER
 })
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets history reads run while chat and ingestion writes commit.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=15000")
+    cursor.close()
+
+@event.listens_for(Session, "before_commit")
+def start_commit_timer(session):
+    session.info["commit_timer"] = True
+    tracer.start("db_commit")
+
+@event.listens_for(Session, "after_commit")
+def stop_commit_timer(session):
+    if session.info.pop("commit_timer", False):
+        tracer.stop()
+
+@event.listens_for(Session, "after_rollback")
+def abort_commit_timer(session):
+    if session.info.pop("commit_timer", False):
+        tracer.stop(failed=True)
+
 FIREBASE_KEY = os.getenv("FIREBASE_API_KEY")
 GEMINI_KEY = os.getenv("GOOGLE_API_KEY")
+# Sent as a header rather than ?key= so the keys never end up in error
+# messages or logged URLs
+FIREBASE_HEADERS = {"x-goog-api-key": FIREBASE_KEY or ""}
+GEMINI_HEADERS = {"x-goog-api-key": GEMINI_KEY or ""}
+# Point these at bench/stub_server.py to run without network access
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+FIREBASE_AUTH_URL = os.getenv("FIREBASE_AUTH_URL", "https://identitytoolkit.googleapis.com/v1").rstrip("/")
 ALLOWED_EXT = {"pdf", "docx", "txt"}
-CHUNK_SIZE = 800
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 800))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 100))
 TOP_K = 3
+# "vector": cosine only; "hybrid": fuse BM25 and cosine rankings (RRF);
+# "prefilter": only score the vectors of the best BM25 matches (a full
+# vector scan when there are fewer than TOP_K)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", 50))
+RRF_K = 60
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", 20))
+PREVIEW_LENGTH = 200
+GEMINI_MODEL = "models/gemini-2.0-flash-exp"
+EMBED_MODEL = "models/text-embedding-004"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 5))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_COMMIT_CHUNKS = int(os.getenv("INGEST_COMMIT_CHUNKS", 200))
+# Jobs whose heartbeat is older than this are taken over by another process
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", 60))
+INGEST_HEARTBEAT_SECONDS = INGEST_STALE_SECONDS / 4
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 10000))
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+# Cosine similarity needed to reuse the reply to a different prompt. Off (1)
+# by default: plain chat replies are shared between users, and every miss
+# costs an extra embedContent call. 0.95 is a reasonable value to opt in.
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 1))
+GEMINI_ERROR_REPLY = "Sorry, I couldn't process your request right now."
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 15))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+HTTP_BREAKER_THRESHOLD = int(os.getenv("HTTP_BREAKER_THRESHOLD", 5))
+HTTP_BREAKER_COOLDOWN = float(os.getenv("HTTP_BREAKER_COOLDOWN", 30))
+HTTP2 = os.getenv("HTTP2", "1").lower() in ("1", "true", "yes")
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", 512 * 1024 * 1024))
+# Users with at least this many chunks are searched through an approximate
+# IVF index (0 disables); ANN_NLIST 0 picks 4 * sqrt(chunks) lists and
+# ANN_PQ_M > 0 adds product quantization with that many sub-vectors
+ANN_THRESHOLD = int(os.getenv("ANN_THRESHOLD", 20000))
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 16))
+ANN_PQ_M = int(os.getenv("ANN_PQ_M", 0))
+# Print one JSON line per request with its duration and per-stage times
+METRICS_LOG = os.getenv("METRICS_LOG", "").lower() in ("1", "true", "yes")
+
+# Metrics (served at /metrics)
+registry = Registry()
+tracer = Tracer(
+    registry.histogram("chatbot_stage_seconds", "Time spent in each processing stage, excluding nested stages",
+                       ["stage"]),
+    registry.counter("chatbot_stage_errors_total", "Errors by processing stage", ["stage"])
+)
+request_seconds = registry.histogram("chatbot_http_request_seconds",
+                                     "Request duration including streamed response bodies",
+                                     ["endpoint", "method", "status"])
+upstream_requests = registry.counter("chatbot_upstream_requests_total", "Upstream API calls by result",
+                                     ["operation", "status"])
+upstream_seconds = registry.histogram("chatbot_upstream_request_seconds", "Upstream API call duration",
+                                      ["operation"])
+upstream_bytes = registry.counter("chatbot_upstream_bytes_total", "Upstream request and response body bytes",
+                                  ["operation", "direction"])
+chunks_scored = registry.histogram("chatbot_retrieval_chunks_scored", "Chunks scored per retrieval query",
+                                   ["source"], buckets=(0, 3, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000))
+
+def observe_upstream(url, status, seconds, sent, received):
+    # e.g. ".../models/gemini-2.0-flash-exp:generateContent" -> "generateContent"
+    operation = urlsplit(url).path.rsplit(":", 1)[-1]
+    upstream_requests.inc(1, operation, status)
+    upstream_seconds.observe(seconds, operation)
+    if sent:
+        upstream_bytes.inc(sent, operation, "sent")
+    if received:
+        upstream_bytes.inc(received, operation, "received")
+
+upstream = HttpClient(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive=HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    timeout=HTTP_TIMEOUT,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    retries=HTTP_RETRIES,
+    backoff=HTTP_BACKOFF,
+    breaker_threshold=HTTP_BREAKER_THRESHOLD,
+    breaker_cooldown=HTTP_BREAKER_COOLDOWN,
+    http2=HTTP2,
+    observe=observe_upstream
+)
+shard_store = ShardStore(VECTOR_FOLDER)
+vector_index = VectorIndex(shard_store, VECTOR_INDEX_MAX_BYTES, ann_threshold=ANN_THRESHOLD,
+                           ann_nlist=ANN_NLIST, ann_nprobe=ANN_NPROBE, ann_pq_m=ANN_PQ_M)
+response_cache = (ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_THRESHOLD)
+                  if RESPONSE_CACHE else None)
+# Shared by all requests so concurrent uploads together stay within the quota
+embed_pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+active_jobs = set()  # ids of jobs queued or running in this process
+active_jobs_lock = threading.Lock()
+monitor_pid = None
 
 # Models
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
 class Message(db.Model):
+    # History is paged newest-first by id within a user
+    __table_args__ = (db.Index("ix_message_user_uid_id", "user_uid", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     user_uid = db.Column(db.String(200))
     text = db.Column(db.Text)
     sender = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "sender": self.sender,
+            "text": self.text,
+            "created_at": self.created_at.isoformat() + "Z" if self.created_at else None
+        }
 
 class Document(db.Model):
+    __table_args__ = (db.Index("ix_document_user_uid_id", "user_uid", "id"),)
     id = db.Column(db.Integer, primary_key=True)
     user_uid = db.Column(db.String(200))
     filename = db.Column(db.String(200))
-    content = db.Column(db.Text)
+    # Full text is only loaded when accessed and only stored once ingestion
+    # ends; listings use the columns below, which ingestion keeps up to date
+    # batch by batch. size_bytes is the UTF-8 size of the
+    # extracted text (uploaded files are not kept, so it's the one size
+    # older rows can be backfilled with too).
+    content = db.deferred(db.Column(db.Text))
+    preview = db.Column(db.Text)
+    chunk_count = db.Column(db.Integer, default=0)
+    size_bytes = db.Column(db.Integer)
+    uploaded_at = db.Column(db.DateTime, default=utcnow)
 
 class Embedding(db.Model):
+    # AUTOINCREMENT: the id of a deleted chunk must never be handed out
+    # again while its vector may still sit in a shard. That only holds for
+    # committed ids (sqlite_sequence rolls back too), so store_chunks commits
+    # the rows before writing their vectors.
+    __table_args__ = {"sqlite_autoincrement": True}
     id = db.Column(db.Integer, primary_key=True)
     doc_id = db.Column(db.Integer, db.ForeignKey("document.id"))
+    # Copy of the document owner, so the chunk_fts index can filter by user
+    user_uid = db.Column(db.String(200))
     chunk = db.Column(db.Text)
-    vector = db.Column(db.PickleType)
+    # Row number in the owner's vector shard (see vector_index.ShardStore)
+    shard_row = db.Column(db.Integer)
+
+class CachedEmbedding(db.Model):
+    # sha256 of (model, normalized text) -> raw float32 vector
+    key = db.Column(db.String(64), primary_key=True)
+    vector = db.Column(db.LargeBinary)
+
+class IngestJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_uid = db.Column(db.String(200))
+    doc_id = db.Column(db.Integer, db.ForeignKey("document.id"))
+    filename = db.Column(db.String(200))
+    filepath = db.Column(db.String(500))
+    status = db.Column(db.String(20), default="queued")  # queued, running, done, failed
+    pages = db.Column(db.Integer, default=0)
+    chunks = db.Column(db.Integer, default=0)
+    embeddings = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "doc_id": self.doc_id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "embeddings": self.embeddings,
+            "error": self.error
+        }
+
+# Database setup
+def upgrade_schema():
+    # create_all() never alters existing tables, so new nullable columns and
+    # indexes are added here for databases created by older versions of the app.
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(db.engine.dialect)
+                db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def enable_autoincrement(table):
+    # SQLite can't add AUTOINCREMENT to an existing table, so the table is
+    # rebuilt with the same ids. Columns the model no longer has (the old
+    # pickled vectors) and triggers go with the old copy; setup_fulltext()
+    # recreates the triggers.
+    sql = db.session.execute(db.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                             {"name": table.name}).scalar()
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return
+    columns = ", ".join(column.name for column in table.columns)
+    db.session.execute(db.text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+    for index in db.inspect(db.session.connection()).get_indexes(f"{table.name}_old"):
+        db.session.execute(db.text(f"DROP INDEX {index['name']}"))
+    table.create(db.session.connection())
+    db.session.execute(db.text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old"))
+    db.session.execute(db.text(f"DROP TABLE {table.name}_old"))
+    db.session.commit()
+
+def migrate_pickled_vectors():
+    # One-shot move of the old pickled float64 `embedding.vector` column into
+    # the per-user float32 shards. Safe to re-run: migrated rows are cleared.
+    columns = {column["name"] for column in db.inspect(db.engine).get_columns("embedding")}
+    if "vector" not in columns:
+        return 0
+    users = db.session.execute(db.text(
+        "SELECT DISTINCT d.user_uid FROM embedding e JOIN document d ON d.id = e.doc_id "
+        "WHERE e.vector IS NOT NULL")).scalars().all()
+    migrated = 0
+    for user_uid in users:
+        rows = db.session.execute(db.text(
+            "SELECT e.id, e.vector FROM embedding e JOIN document d ON d.id = e.doc_id "
+            "WHERE e.vector IS NOT NULL AND d.user_uid = :uid"), {"uid": user_uid}).all()
+        ids = [id for id, _ in rows]
+        # A run that died before its commit may already have appended them.
+        shard_store.delete(user_uid, ids)
+        shard_rows = shard_store.append(user_uid, ids, [pickle.loads(blob) for _, blob in rows])
+        db.session.execute(db.text("UPDATE embedding SET vector = NULL, shard_row = :row WHERE id = :id"),
+                           [{"id": id, "row": row} for id, row in zip(ids, shard_rows)])
+        db.session.commit()
+        migrated += len(rows)
+    return migrated
+
+def backfill_columns():
+    # Fills columns added after rows were written by older versions.
+    db.session.execute(db.text(
+        "UPDATE embedding SET user_uid = (SELECT user_uid FROM document WHERE document.id = embedding.doc_id) "
+        "WHERE user_uid IS NULL"))
+    db.session.execute(db.text(
+        "UPDATE document SET "
+        "chunk_count = (SELECT count(*) FROM embedding WHERE embedding.doc_id = document.id), "
+        "preview = CASE WHEN length(content) > :n THEN substr(content, 1, :n) || '...' ELSE content END, "
+        "size_bytes = length(CAST(content AS BLOB)) "
+        "WHERE chunk_count IS NULL"), {"n": PREVIEW_LENGTH})
+    db.session.commit()
+
+def setup_fulltext():
+    # BM25 index over chunks, kept in sync with the embedding table by
+    # triggers (external-content FTS5 table, so chunk text isn't stored twice).
+    try:
+        exists = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'chunk_fts'")).first()
+        db.session.execute(db.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunk_fts USING "
+            "fts5(chunk, user_uid, content='embedding', content_rowid='id')"))
+        db.session.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS embedding_fts_insert AFTER INSERT ON embedding BEGIN "
+            "INSERT INTO chunk_fts(rowid, chunk, user_uid) VALUES (new.id, new.chunk, new.user_uid); END"))
+        db.session.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS embedding_fts_delete AFTER DELETE ON embedding BEGIN "
+            "INSERT INTO chunk_fts(chunk_fts, rowid, chunk, user_uid) "
+            "VALUES ('delete', old.id, old.chunk, old.user_uid); END"))
+        db.session.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS embedding_fts_update AFTER UPDATE OF chunk, user_uid ON embedding BEGIN "
+            "INSERT INTO chunk_fts(chunk_fts, rowid, chunk, user_uid) "
+            "VALUES ('delete', old.id, old.chunk, old.user_uid); "
+            "INSERT INTO chunk_fts(rowid, chunk, user_uid) VALUES (new.id, new.chunk, new.user_uid); END"))
+        if not exists:
+            db.session.execute(db.text("INSERT INTO chunk_fts(chunk_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Full-text search unavailable: {e}")
+
+def init_db():
+    db.create_all()
+    upgrade_schema()
+    backfill_columns()
+    migrated = migrate_pickled_vectors()
+    if migrated:
+        print(f"Migrated {migrated} pickled embeddings to vector shards")
+    for table in db.metadata.sorted_tables:
+        if table.dialect_options["sqlite"]["autoincrement"]:
+            enable_autoincrement(table)
+    setup_fulltext()
+
+@app.cli.command("init-db")
+def init_db_command():
+    init_db()
 
 # Helper Functions
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXT
 
-def chunk_text(text):
-    text = text.strip()
-    return [text[i:i+CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
-
-def extract_text(filepath):
+def iter_pages(filepath):
+    # Yields the document a page (PDF), paragraph (DOCX) or block (TXT) at a
+    # time so large files never have to be held in memory as one string.
+    # Pages and paragraphs end with a line break; TXT blocks are raw slices
+    # of the file and concatenate back to it exactly.
     ext = filepath.rsplit(".", 1)[-1].lower()
-    try:
-        if ext == "pdf":
-            return "\n".join(page.get_text("text") for page in fitz.open(filepath))
-        elif ext == "docx":
-            return "\n".join(p.text for p in docx.Document(filepath).paragraphs if p.text.strip())
-        elif ext == "txt":
-            with open(filepath, encoding="utf-8") as f:
-                return f.read()
-    except Exception as e:
-        print(f"Extract error: {e}")
-    return ""
+    if ext == "pdf":
+        with fitz.open(filepath) as pdf:
+            for page in pdf:
+                yield page.get_text("text") + "\n"
+    elif ext == "docx":
+        for p in docx.Document(filepath).paragraphs:
+            if p.text.strip():
+                yield p.text + "\n"
+    elif ext == "txt":
+        with open(filepath, encoding="utf-8") as f:
+            for block in iter(lambda: f.read(64 * 1024), ""):
+                yield block
 
-def clean_ai_response(response_text):
-    if not response_text:
-        return response_text
-    text = re.sub(r'\n\s*\n\s*\n', '\n\n', response_text.strip())
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+def iter_units(pages):
+    # Splits the page stream into sentences/paragraphs, each keeping its
+    # trailing whitespace. A sentence running over a page break is only
+    # yielded once it is complete.
+    buffer = ""
+    for page in pages:
+        buffer += page
+        start = 0
+        for match in SENTENCE_BREAK.finditer(buffer):
+            yield buffer[start:match.end()]
+            start = match.end()
+        buffer = buffer[start:]
+        # Text without any sentence breaks (tables, code) is passed on as-is
+        # rather than buffered indefinitely.
+        if len(buffer) > CHUNK_SIZE:
+            cut = buffer.rfind(" ", 0, len(buffer) - 1) + 1 or len(buffer)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer:
+        yield buffer
+
+def split_long(unit):
+    while len(unit) > CHUNK_SIZE:
+        cut = unit.rfind(" ", 0, CHUNK_SIZE) + 1 or CHUNK_SIZE
+        yield unit[:cut]
+        unit = unit[cut:]
+    yield unit
+
+def iter_chunks(pages):
+    """Packs whole sentences into chunks of up to CHUNK_SIZE characters,
+    repeating up to CHUNK_OVERLAP characters of trailing sentences at the
+    start of the next chunk. Yields (chunk, new_text) where new_text is the
+    document text the chunk adds beyond the overlap."""
+    window, size, carried = [], 0, 0
+    for unit in iter_units(pages):
+        for piece in split_long(unit):
+            if window and size + len(piece) > CHUNK_SIZE:
+                if len(window) > carried:
+                    chunk = "".join(window).strip()
+                    if chunk:
+                        yield chunk, "".join(window[carried:])
+                    keep = []
+                    for part in reversed(window):
+                        if sum(map(len, keep)) + len(part) > CHUNK_OVERLAP:
+                            break
+                        keep.insert(0, part)
+                    window, carried = keep, len(keep)
+                    size = sum(map(len, window))
+                while window and size + len(piece) > CHUNK_SIZE:
+                    size -= len(window.pop(0))
+                    carried -= 1
+            window.append(piece)
+            size += len(piece)
+    if len(window) > carried and "".join(window).strip():
+        yield "".join(window).strip(), "".join(window[carried:])
+
+def format_markdown(text):
+    text = re.sub(r'\n\s*\n\s*\n', '\n\n', text)
     text = re.sub(r'\*\*([^*]+)\*\*', r'**\1**', text)
     text = re.sub(r'\*\*\*([^*:]+):\*\*', r'**\1:**', text)
     text = re.sub(r'\*{3,}', '**', text)
@@ -77,33 +456,86 @@ def clean_ai_response(response_text):
     text = re.sub(r'\*\*([^*:]+):\*\*([^\n])', r'**\1:** \2', text)
     text = re.sub(r':\s*([A-Z])', r': \1', text)
     text = re.sub(r' +', ' ', text)
-    
-    return text.strip()
+    return text
+
+@tracer.wrap("format")
+def clean_ai_response(response_text):
+    if not response_text:
+        return response_text
+    return format_markdown(response_text.strip()).strip()
+
+class StreamingFormatter:
+    # Incremental clean_ai_response(). Text is released up to the last
+    # whitespace where none of the rules can reach across the cut: trailing
+    # whitespace, "*" and ":" are held back and "**" pairs are never split,
+    # so a long paragraph streams word by word. For ordinary markdown,
+    # joining everything feed() and finish() return gives the same result as
+    # cleaning the whole response at once.
+    def __init__(self):
+        self.buffer = ""
+        self.started = False
+
+    def _safe_cut(self):
+        end = len(self.buffer)
+        while True:
+            space = max(self.buffer.rfind(" ", 0, end), self.buffer.rfind("\t", 0, end),
+                        self.buffer.rfind("\n", 0, end))
+            if space < 0:
+                return 0
+            head = self.buffer[:space].rstrip(" \t\r\n*:")
+            if head.count("**") % 2 == 0:
+                return len(head)
+            # Cut before the unmatched "**" instead
+            end = head.rfind("**")
 
+    def _emit(self, text):
+        text = format_markdown(text)
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    @tracer.wrap("format")
+    def feed(self, text):
+        self.buffer += text
+        cut = self._safe_cut()
+        if not cut:
+            return ""
+        head, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return self._emit(head)
+
+    @tracer.wrap("format")
+    def finish(self):
+        head, self.buffer = self.buffer.rstrip(), ""
+        return self._emit(head).rstrip()
+
+@tracer.wrap("firebase_auth")
 def firebase_auth(endpoint, email, password):
     try:
-        response = requests.post(
-            f"{endpoint}?key={FIREBASE_KEY}",
-            json={"email": email, "password": password, "returnSecureToken": True},
-            timeout=10
+        response = upstream.post(
+            endpoint,
+            headers=FIREBASE_HEADERS,
+            json={"email": email, "password": password, "returnSecureToken": True}
         )
         return response.json()
     except Exception as e:
         print(f"Firebase auth error: {e}")
+        tracer.error("firebase_auth")
         return {"error": {"message": "Authentication failed"}}
 
-def ask_gemini(text):
-    try:
-        formatted_prompt = f"""Please provide a clean, well-formatted response to the following question. 
+def format_prompt(text):
+    return f"""Please provide a clean, well-formatted response to the following question. 
 Use proper markdown formatting with clear headings and bullet points where appropriate.
 
 Question: {text}"""
-        
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent?key={GEMINI_KEY}",
-            headers={"Content-Type": "application/json"},
-            json={"contents": [{"parts": [{"text": formatted_prompt}]}]},
-            timeout=15
+
+@tracer.wrap("gemini")
+def ask_gemini(text):
+    try:
+        response = upstream.post(
+            f"{GEMINI_BASE_URL}/{GEMINI_MODEL}:generateContent",
+            headers=GEMINI_HEADERS,
+            json={"contents": [{"parts": [{"text": format_prompt(text)}]}]}
         )
         data = response.json()
         raw_response = data["candidates"][0]["content"]["parts"][0]["text"]
@@ -111,48 +543,427 @@ Question: {text}"""
         
     except Exception as e:
         print(f"Gemini error: {e}")
-        return "Sorry, I couldn't process your request right now."
+        tracer.error("gemini")
+        return GEMINI_ERROR_REPLY
 
+def stream_gemini(text):
+    # Yields raw text fragments as Gemini generates them.
+    with upstream.stream(
+        "POST",
+        f"{GEMINI_BASE_URL}/{GEMINI_MODEL}:streamGenerateContent?alt=sse",
+        headers=GEMINI_HEADERS,
+        json={"contents": [{"parts": [{"text": format_prompt(text)}]}]}
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line or not line.startswith("data:"):
+                continue
+            data = json.loads(line[5:])
+            for candidate in data.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+
+def load_cached_embeddings(keys):
+    rows = []
+    for i in range(0, len(keys), 500):
+        rows += db.session.query(CachedEmbedding.key, CachedEmbedding.vector).filter(
+            CachedEmbedding.key.in_(keys[i:i + 500])).all()
+    return dict(rows)
+
+def save_cached_embeddings(items):
+    # Part of the caller's transaction; concurrent writers of the same key
+    # are harmless because the content is identical.
+    db.session.execute(sqlite_insert(CachedEmbedding).on_conflict_do_nothing(),
+                       [{"key": key, "vector": vector} for key, vector in items.items()])
+
+embedding_cache = EmbeddingCache(EMBED_MODEL, EMBED_CACHE_SIZE, load_cached_embeddings, save_cached_embeddings)
+
+@tracer.wrap("embed")
 def get_embedding(text):
+    vector = embedding_cache.get_many([text])[0]
+    if vector is not None:
+        return vector
     try:
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={GEMINI_KEY}",
-            headers={"Content-Type": "application/json"},
-            json={"model": "models/text-embedding-004", "content": {"parts": [{"text": text}]}},
-            timeout=15
+        response = upstream.post(
+            f"{GEMINI_BASE_URL}/{EMBED_MODEL}:embedContent",
+            headers=GEMINI_HEADERS,
+            json={"model": EMBED_MODEL, "content": {"parts": [{"text": text}]}}
         )
         data = response.json()
-        return np.array(data.get("embedding", {}).get("values", []), dtype=float)
+        vector = np.array(data.get("embedding", {}).get("values", []), dtype=float)
     except Exception as e:
         print(f"Embedding error: {e}")
+        tracer.error("embed")
         return None
+    embedding_cache.put_many([text], [vector])
+    return vector
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def embed_batch(texts):
+    # Retries are handled per chunk by embed_batch_with_retry, not the client.
+    response = upstream.post(
+        f"{GEMINI_BASE_URL}/{EMBED_MODEL}:batchEmbedContents",
+        headers=GEMINI_HEADERS,
+        json={"requests": [{"model": EMBED_MODEL, "content": {"parts": [{"text": text}]}} for text in texts]},
+        retries=0,
+        timeout=HTTP_TIMEOUT * 2
+    )
+    if response.status_code == 429 or response.status_code >= 500:
+        retry_after = response.headers.get("Retry-After")
+        raise RetryableError(f"HTTP {response.status_code}",
+                             float(retry_after) if retry_after and retry_after.isdigit() else None)
+    data = response.json()
+    if "error" in data:
+        raise ValueError(data["error"].get("message", "Unknown error"))
+    return [np.array(e.get("values", []), dtype=float) for e in data.get("embeddings", [])]
+
+def embed_batch_with_retry(texts):
+    # Retries only the texts that have not been embedded yet, backing off
+    # exponentially (with jitter) on rate limits and server errors.
+    results = [None] * len(texts)
+    pending = list(range(len(texts)))
+    for attempt in range(EMBED_MAX_RETRIES):
+        delay = None
+        try:
+            vectors = embed_batch([texts[i] for i in pending])
+            failed = [i for i, vector in zip(pending, vectors) if not vector.size]
+            for i, vector in zip(pending, vectors):
+                if vector.size:
+                    results[i] = vector
+            pending = failed + pending[len(vectors):]
+        except (RetryableError, httpx.TransportError, CircuitOpenError) as e:
+            # Timeouts, resets and an open circuit are as transient as a 429.
+            delay = getattr(e, "retry_after", None)
+            print(f"Embedding batch retry {attempt + 1}: {e!r}")
+            tracer.error("embed_batch")
+        except Exception as e:
+            print(f"Embedding batch error: {e}")
+            tracer.error("embed_batch")
+            break
+        if not pending or attempt == EMBED_MAX_RETRIES - 1:
+            break
+        time.sleep(delay or min(30, 2 ** attempt) * (0.5 + random.random()))
+    return results
+
+@tracer.wrap("embed")
+def get_embeddings(texts):
+    """Embed many texts with batched calls, EMBED_CONCURRENCY batches at a
+    time. Returns one vector (or None on failure) per input text."""
+    results = embedding_cache.get_many(texts)
+    # Texts that normalize to the same cache key are only embedded once.
+    missing = {embedding_cache.key(text): text for text, r in zip(texts, results) if r is None}
+    if not missing:
+        return results
+    unique = list(missing.values())
+    batches = [unique[i:i + EMBED_BATCH_SIZE] for i in range(0, len(unique), EMBED_BATCH_SIZE)]
+    fetched = []
+    for vectors in embed_pool.map(embed_batch_with_retry, batches):
+        fetched.extend(vectors)
+    embedding_cache.put_many(unique, fetched)
+    fetched = dict(zip(missing, fetched))
+    return [fetched[embedding_cache.key(text)] if r is None else r for text, r in zip(texts, results)]
+
+def store_chunks(user_uid, doc_id, chunks):
+    # Embeds and stores one batch of chunks; the caller commits.
+    chunks = [chunk for chunk in chunks if chunk.strip()]
+    # The ingest job has pending progress updates; an autoflush by the cache
+    # lookup would take SQLite's write lock for the whole (slow) embedding.
+    with db.session.no_autoflush:
+        embedded = get_embeddings(chunks)
+    embeddings, vectors = [], []
+    for chunk, vector in zip(chunks, embedded):
+        if vector is not None and vector.size > 0:
+            embeddings.append(Embedding(doc_id=doc_id, user_uid=user_uid, chunk=chunk))
+            vectors.append(vector)
+    db.session.add_all(embeddings)
+    db.session.flush()
+    ids = [e.id for e in embeddings]
+    # The ids must be committed before they reach the shard. Rows left
+    # without a shard_row if the batch fails are removed by
+    # discard_unstored_chunks.
+    db.session.commit()
+    shard_rows = shard_store.append(user_uid, ids, vectors)
+    if ids:
+        db.session.execute(db.update(Embedding), [{"id": id, "shard_row": row} for id, row in zip(ids, shard_rows)])
+    return ids, shard_rows
+
+def discard_unstored_chunks(job):
+    # Chunks committed by store_chunks whose batch then failed or was cut
+    # short by a crash; their vectors may already be in the shard.
+    if job.doc_id is None:
+        return
+    ids = db.session.execute(db.select(Embedding.id).where(
+        Embedding.doc_id == job.doc_id, Embedding.shard_row.is_(None))).scalars().all()
+    if ids:
+        shard_store.delete(job.user_uid, ids)
+        Embedding.query.filter(Embedding.id.in_(ids)).delete()
+        db.session.commit()
+
+def commit_chunks(job, batch):
+    # batch: [(chunk, new_text)] as produced by iter_chunks
+    chunks = [chunk for chunk, _ in batch]
+    ids, shard_rows = store_chunks(job.user_uid, job.doc_id, chunks)
+    text = "".join(new_text for _, new_text in batch)
+    if not job.chunks:
+        text = text.lstrip()
+    data = text.encode("utf-8")
+    # The text goes to a side file (see ingest) rather than being appended to
+    # document.content, which SQLite would rewrite whole on every batch.
+    with open(job.filepath + ".text", "ab") as f:
+        f.write(data)
+    values = {"chunk_count": Document.chunk_count + len(ids), "size_bytes": Document.size_bytes + len(data)}
+    if not job.chunks:
+        # The first batch starts the document (and is all of it if shorter).
+        preview = text.rstrip()
+        values["preview"] = preview[:PREVIEW_LENGTH] + "..." if len(preview) > PREVIEW_LENGTH else preview
+    try:
+        updated = db.session.execute(db.update(Document).where(Document.id == job.doc_id)
+                                     .values(**values)).rowcount
+        if not updated:
+            raise RuntimeError("Document was deleted during processing")
+        job.chunks += len(batch)
+        job.embeddings += len(ids)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        shard_store.delete(job.user_uid, ids, shard_rows)
+        Embedding.query.filter(Embedding.id.in_(ids)).delete()
+        db.session.commit()
+        raise
+
+def submit_ingest_job(job_id):
+    with active_jobs_lock:
+        active_jobs.add(job_id)
+    ingest_pool.submit(run_ingest_job, job_id)
 
+def run_ingest_job(job_id):
+    try:
+        ingest(job_id)
+    finally:
+        with active_jobs_lock:
+            active_jobs.discard(job_id)
+
+def ingest(job_id):
+    with app.app_context():
+        job = db.session.get(IngestJob, job_id)
+        if job.status == "running":
+            # Resumed after a crash.
+            discard_unstored_chunks(job)
+        job.status = "running"
+        job.pages = 0
+        db.session.commit()
+        text_path = job.filepath + ".text"
+        try:
+            # Chunking is deterministic, so a resumed job skips the chunks a
+            # previous run already committed. Their text is the first
+            # size_bytes of the side file; anything after that was written by
+            # a run that died before committing.
+            done, batch = job.chunks, []
+            size = db.session.query(Document.size_bytes).filter_by(id=job.doc_id).scalar() or 0
+            if os.path.exists(text_path) and os.path.getsize(text_path) > size:
+                os.truncate(text_path, size)
+
+            def pages():
+                for page in iter_pages(job.filepath):
+                    job.pages += 1
+                    yield page
+
+            chunks = tracer.iterate("chunk", iter_chunks(tracer.iterate("extract", pages())))
+            for index, item in enumerate(chunks):
+                if index < done:
+                    continue
+                batch.append(item)
+                if len(batch) >= INGEST_COMMIT_CHUNKS:
+                    commit_chunks(job, batch)
+                    batch = []
+            if batch:
+                commit_chunks(job, batch)
+
+            if job.chunks:
+                job.status = "done"
+            else:
+                job.status = "failed"
+                job.error = "Could not extract text from the file"
+        except Exception as e:
+            print(f"Ingest error: {e}")
+            tracer.error("ingest", e)
+            db.session.rollback()
+            discard_unstored_chunks(job)
+            job.status = "failed"
+            job.error = str(e)
+        if job.status == "failed" and not job.chunks:
+            Document.query.filter_by(id=job.doc_id).delete()
+            job.doc_id = None
+        elif os.path.exists(text_path):
+            # The full text is stored in a single write at the end.
+            with open(text_path, encoding="utf-8") as f:
+                db.session.execute(db.update(Document).where(Document.id == job.doc_id).values(content=f.read()))
+        db.session.commit()
+        for path in (job.filepath, text_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def resume_ingest_jobs():
+    # Re-queue jobs interrupted by a crash or restart, i.e. whose owner has
+    # stopped sending heartbeats. The conditional UPDATE makes sure only one
+    # process picks up each job.
+    stale = utcnow() - datetime.timedelta(seconds=INGEST_STALE_SECONDS)
+    with active_jobs_lock:
+        own = list(active_jobs)
+    jobs = IngestJob.query.filter(IngestJob.status.in_(["queued", "running"]),
+                                  IngestJob.updated_at < stale, IngestJob.id.not_in(own)).all()
+    for job in jobs:
+        claimed = db.session.execute(
+            db.update(IngestJob)
+            .where(IngestJob.id == job.id, IngestJob.updated_at == job.updated_at)
+            .values(status="running", updated_at=utcnow())).rowcount
+        db.session.commit()
+        if claimed:
+            submit_ingest_job(job.id)
+
+def heartbeat_ingest_jobs():
+    # Marks this process's jobs as alive, including ones still waiting for a
+    # free ingest worker.
+    with active_jobs_lock:
+        own = list(active_jobs)
+    if own:
+        db.session.execute(db.update(IngestJob)
+                           .where(IngestJob.id.in_(own), IngestJob.status.in_(["queued", "running"]))
+                           .values(updated_at=utcnow()))
+        db.session.commit()
+
+def monitor_ingest_jobs():
+    while True:
+        try:
+            with app.app_context():
+                heartbeat_ingest_jobs()
+                resume_ingest_jobs()
+        except Exception as e:
+            print(f"Ingest monitor error: {e}")
+            tracer.error("ingest_monitor")
+        time.sleep(INGEST_HEARTBEAT_SECONDS)
+
+def start_ingest_monitor():
+    # One monitor thread per process, started again in forked workers.
+    global monitor_pid
+    with active_jobs_lock:
+        if monitor_pid == os.getpid():
+            return
+        monitor_pid = os.getpid()
+    threading.Thread(target=monitor_ingest_jobs, name="ingest-monitor", daemon=True).start()
+
+def delete_user_vectors(user_uid, rows):
+    dead, live = shard_store.delete(user_uid, [id for id, _ in rows], [row for _, row in rows])
+    if dead > live:
+        new_rows = shard_store.compact(user_uid)
+        existing = db.session.query(Embedding.id).join(Document).filter(
+            Document.user_uid == user_uid, Embedding.id.in_(new_rows)).all()
+        db.session.execute(db.update(Embedding),
+                           [{"id": id, "shard_row": new_rows[id]} for id, in existing])
+        db.session.commit()
+
+fulltext_ready = None  # whether chunk_fts exists; checked on first use
+
+def has_fulltext():
+    global fulltext_ready
+    if fulltext_ready is None:
+        fulltext_ready = db.session.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'chunk_fts'")).first() is not None
+    return fulltext_ready
+
+@tracer.wrap("lexical_search")
+def search_lexical(query, user_uid, limit):
+    # BM25 matches among the user's chunks as [(embedding_id, shard_row)],
+    # best first. Empty when FTS5 is unavailable or nothing matches.
+    terms = list(dict.fromkeys(t for t in re.findall(r"\w+", query.lower()) if len(t) > 1))[:32]
+    if not terms or not has_fulltext():
+        return []
+    owner = user_uid.replace('"', '""')
+    match = f'user_uid:"{owner}" AND chunk:(' + " OR ".join(f'"{t}"' for t in terms) + ")"
+    try:
+        return db.session.execute(db.text(
+            "SELECT e.id, e.shard_row FROM chunk_fts JOIN embedding e ON e.id = chunk_fts.rowid "
+            "WHERE chunk_fts MATCH :match ORDER BY bm25(chunk_fts) LIMIT :limit"),
+            {"match": match, "limit": limit}).all()
+    except Exception as e:
+        # A failed SELECT leaves the transaction open, so the caller's pending
+        # changes (e.g. the user's message) are kept.
+        print(f"Lexical search error: {e}")
+        tracer.error("lexical_search")
+        return []
+
+def fuse_rankings(*rankings):
+    # Reciprocal rank fusion of several best-first lists of ids.
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def search_vectors(user_uid, query_embedding, k, candidates=None):
+    stats = {}
+    with tracer.timed("vector_search"):
+        hits = vector_index.search(user_uid, query_embedding, k, candidates=candidates, stats=stats)
+    chunks_scored.observe(stats.get("scored", 0), "vector")
+    return hits
+
+@tracer.wrap("retrieval")
 def search_similar(query, user_uid):
+    lexical = search_lexical(query, user_uid, RETRIEVAL_CANDIDATES) if RETRIEVAL_MODE != "vector" else []
+    if RETRIEVAL_MODE != "vector":
+        chunks_scored.observe(len(lexical), "lexical")
     query_embedding = get_embedding(query)
     if query_embedding is None or not query_embedding.size:
+        ids = [id for id, _ in lexical][:TOP_K]
+    elif RETRIEVAL_MODE == "prefilter":
+        # Too few BM25 matches to choose from: fall back to a full scan.
+        candidates = lexical if len(lexical) >= TOP_K else None
+        ids = [id for id, _ in search_vectors(user_uid, query_embedding, TOP_K, candidates=candidates)]
+    elif lexical:
+        hits = search_vectors(user_uid, query_embedding, RETRIEVAL_CANDIDATES)
+        ids = fuse_rankings([id for id, _ in hits], [id for id, _ in lexical])[:TOP_K]
+    else:
+        ids = [id for id, _ in search_vectors(user_uid, query_embedding, TOP_K)]
+    if not ids:
         return []
     
-    query_norm = np.linalg.norm(query_embedding)
-    if query_norm == 0:
-        return []
-    
-    scored_chunks = []
-    embeddings = Embedding.query.join(Document).filter(Document.user_uid == user_uid).all()
+    with tracer.timed("chunk_fetch"):
+        chunks = dict(db.session.query(Embedding.id, Embedding.chunk)
+                      .filter(Embedding.user_uid == user_uid, Embedding.id.in_(ids)).all())
+    return [chunks[id] for id in ids if id in chunks]
+
+# Request hooks
+@app.before_request
+def ensure_ingest_monitor():
+    if monitor_pid != os.getpid():
+        start_ingest_monitor()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    tracer.begin()
+
+@app.after_request
+def record_request_time(response):
+    start, endpoint, method, path = g.request_start, request.endpoint or "unmatched", request.method, request.path
     
-    for embedding in embeddings:
-        vector = np.asarray(embedding.vector, dtype=float)
-        if vector.size != query_embedding.size:
-            continue
-        
-        vector_norm = np.linalg.norm(vector)
-        if vector_norm == 0:
-            continue
-            
-        similarity = np.dot(query_embedding, vector) / (query_norm * vector_norm)
-        scored_chunks.append((similarity, embedding.chunk))
+    def finish():
+        # Called once the body has been sent, so streamed replies count fully.
+        elapsed = time.perf_counter() - start
+        request_seconds.observe(elapsed, endpoint, method, response.status_code)
+        stages = tracer.end()
+        if METRICS_LOG:
+            print(json.dumps({"method": method, "path": path, "endpoint": endpoint,
+                              "status": response.status_code, "ms": round(elapsed * 1000, 2),
+                              "stages": {stage: round(t * 1000, 2) for stage, t in stages.items()}}), flush=True)
     
-    scored_chunks.sort(key=lambda x: x[0], reverse=True)
-    return [chunk for _, chunk in scored_chunks[:TOP_K]]
+    response.call_on_close(finish)
+    return response
 
 # Routes
 @app.route("/")
@@ -164,19 +975,30 @@ def documents():
     if "user_uid" not in session:
         return redirect(url_for("login"))
     
-    user_docs = Document.query.filter_by(user_uid=session["user_uid"]).all()
-    docs_with_chunks = []
+    before = request.args.get("before", type=int)
+    query = db.session.query(Document.id, Document.filename, Document.chunk_count,
+                             Document.preview, Document.size_bytes, Document.uploaded_at
+                             ).filter(Document.user_uid == session["user_uid"])
+    if before is not None:
+        query = query.filter(Document.id < before)
+    rows = query.order_by(Document.id.desc()).limit(DOCUMENTS_PAGE_SIZE + 1).all()
     
-    for doc in user_docs:
-        chunk_count = Embedding.query.filter_by(doc_id=doc.id).count()
-        docs_with_chunks.append({
-            'id': doc.id,
-            'filename': doc.filename,
-            'chunk_count': chunk_count,
-            'content_preview': doc.content[:200] + "..." if len(doc.content) > 200 else doc.content
-        })
+    docs = [{
+        'id': row.id,
+        'filename': row.filename,
+        'chunk_count': row.chunk_count or 0,
+        'content_preview': row.preview or "",
+        'size_bytes': row.size_bytes,
+        'uploaded_at': row.uploaded_at.isoformat() + "Z" if row.uploaded_at else None
+    } for row in rows[:DOCUMENTS_PAGE_SIZE]]
+    next_before = docs[-1]['id'] if len(rows) > DOCUMENTS_PAGE_SIZE else None
     
-    return jsonify({"documents": docs_with_chunks})
+    # The ETag lets script.js revalidate with If-None-Match and get a 304
+    # when nothing changed since it last opened the list.
+    response = jsonify({"documents": docs, "next_before": next_before})
+    response.add_etag()
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 @app.route("/delete_document/<int:doc_id>", methods=["POST"])
 def delete_document(doc_id):
@@ -187,11 +1009,14 @@ def delete_document(doc_id):
     if not doc:
         return jsonify({"error": "Document not found"}), 404
     
+    rows = db.session.query(Embedding.id, Embedding.shard_row).filter_by(doc_id=doc_id).all()
     # Delete associated embeddings
     Embedding.query.filter_by(doc_id=doc_id).delete()
     # Delete document
     db.session.delete(doc)
     db.session.commit()
+    delete_user_vectors(session["user_uid"], rows)
+    invalidate_replies(session["user_uid"])
     
     return jsonify({"success": True})
 
@@ -219,6 +1044,9 @@ def clear_documents():
     # Delete all documents for user
     Document.query.filter_by(user_uid=user_uid).delete()
     db.session.commit()
+    shard_store.remove(user_uid)
+    vector_index.drop(user_uid)
+    invalidate_replies(user_uid)
     flash("All document history deleted successfully!")
     return redirect(url_for("chat"))
 
@@ -226,7 +1054,7 @@ def clear_documents():
 def signup():
     if request.method == "POST":
         result = firebase_auth(
-            "https://identitytoolkit.googleapis.com/v1/accounts:signUp",
+            f"{FIREBASE_AUTH_URL}/accounts:signUp",
             request.form["email"], 
             request.form["password"]
         )
@@ -241,7 +1069,7 @@ def signup():
 def login():
     if request.method == "POST":
         result = firebase_auth(
-            "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword",
+            f"{FIREBASE_AUTH_URL}/accounts:signInWithPassword",
             request.form["email"], 
             request.form["password"]
         )
@@ -264,46 +1092,77 @@ def upload():
     if "user_uid" not in session:
         return redirect(url_for("login"))
     
+    wants_json = request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
     file = request.files.get("file")
     if not file or not allowed_file(file.filename):
+        if wants_json:
+            return jsonify({"error": "Please select a valid file (PDF, DOCX, or TXT)"}), 400
         flash("Please select a valid file (PDF, DOCX, or TXT)")
         return redirect(url_for("chat"))
     
+    user_uid = session["user_uid"]
     filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file.save(filepath)
-    
-    text = extract_text(filepath)
-    if not text.strip():
-        flash("Could not extract text from the file")
-        os.remove(filepath)
-        return redirect(url_for("chat"))
+    job = IngestJob(id=uuid.uuid4().hex, user_uid=user_uid, filename=filename, status="queued")
+    job.filepath = os.path.join(app.config["UPLOAD_FOLDER"], f"{job.id}_{filename}")
+    file.save(job.filepath)
     
-    user_uid = session["user_uid"]
-    doc = Document(user_uid=user_uid, filename=filename, content=text)
+    doc = Document(user_uid=user_uid, filename=filename, content="", chunk_count=0, size_bytes=0)
     db.session.add(doc)
     db.session.flush()
-    
-    chunks = chunk_text(text)
-    success_count = 0
-    for chunk in chunks:
-        if chunk.strip():
-            vector = get_embedding(chunk)
-            if vector is not None and vector.size > 0:
-                embedding = Embedding(doc_id=doc.id, chunk=chunk, vector=vector)
-                db.session.add(embedding)
-                success_count += 1
-    
+    job.doc_id = doc.id
+    db.session.add(job)
     db.session.commit()
-    os.remove(filepath)
-    
-    if success_count > 0:
-        flash(f"Document uploaded successfully! Created {success_count} searchable chunks.")
-    else:
-        flash("Document uploaded but no embeddings could be created.")
+    submit_ingest_job(job.id)
+    invalidate_replies(user_uid)
     
+    if wants_json:
+        return jsonify({"job_id": job.id, "status_url": url_for("job_status", job_id=job.id)}), 202
+    flash("Document upload started. It will be searchable once processing finishes.")
     return redirect(url_for("chat"))
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    if "user_uid" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    job = IngestJob.query.filter_by(id=job_id, user_uid=session["user_uid"]).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+def build_prompt(user_message, user_uid, mode):
+    if mode != "rag":
+        return user_message
+    context_chunks = search_similar(user_message, user_uid)
+    if context_chunks:
+        context = "\n\n".join(context_chunks)
+        return f"Based on the following context, answer the question. If the context doesn't contain relevant information, say so.\n\nContext:\n{context}\n\nQuestion: {user_message}"
+    return f"I don't have any relevant documents uploaded to answer this question: {user_message}\n\nPlease upload some documents first to use Document Q&A mode."
+
+def response_scope(user_uid, mode):
+    # RAG replies depend on the user's documents, so the shard version is
+    # part of the scope: any upload or delete makes older replies unreachable.
+    if mode != "rag":
+        return "chat"
+    return f"rag:{user_uid}:{shard_store.version(user_uid)}"
+
+def lookup_reply(user_message, user_uid, mode):
+    # Returns (cached reply or None, key to store a fresh reply under).
+    if response_cache is None:
+        return None, None
+    scope = response_scope(user_uid, mode)
+    vector = get_embedding(user_message) if response_cache.semantic else None
+    return response_cache.get(scope, user_message, vector), (scope, user_message, vector)
+
+def remember_reply(cache_key, reply):
+    if cache_key and reply and reply != GEMINI_ERROR_REPLY:
+        scope, user_message, vector = cache_key
+        response_cache.put(scope, user_message, reply, vector)
+
+def invalidate_replies(user_uid):
+    if response_cache is not None:
+        response_cache.invalidate(f"rag:{user_uid}:")
+
 @app.route("/chat", methods=["GET", "POST"])
 def chat():
     if "user_uid" not in session:
@@ -320,17 +1179,14 @@ def chat():
         user_msg_obj = Message(user_uid=user_uid, text=user_message, sender="user")
         db.session.add(user_msg_obj)
         
-        if mode == "rag":
-            context_chunks = search_similar(user_message, user_uid)
-            if context_chunks:
-                context = "\n\n".join(context_chunks)
-                prompt = f"Based on the following context, answer the question. If the context doesn't contain relevant information, say so.\n\nContext:\n{context}\n\nQuestion: {user_message}"
-            else:
-                prompt = f"I don't have any relevant documents uploaded to answer this question: {user_message}\n\nPlease upload some documents first to use Document Q&A mode."
-        else:
-            prompt = user_message
-        
-        bot_reply = ask_gemini(prompt)
+        bot_reply, cache_key = lookup_reply(user_message, user_uid, mode)
+        prompt = build_prompt(user_message, user_uid, mode) if bot_reply is None else None
+        # Don't hold the SQLite write lock (the user message, embedding cache
+        # inserts) while Gemini answers.
+        db.session.commit()
+        if bot_reply is None:
+            bot_reply = ask_gemini(prompt)
+            remember_reply(cache_key, bot_reply)
         
         bot_msg_obj = Message(user_uid=user_uid, text=bot_reply, sender="bot")
         db.session.add(bot_msg_obj)
@@ -338,12 +1194,114 @@ def chat():
         
         return jsonify({"reply": bot_reply})
     
-    messages = Message.query.filter_by(user_uid=user_uid).all()
+    messages, next_before = history_page(user_uid)
     return render_template("chat.html", 
-                        messages=messages, 
+                        messages=reversed(messages), 
+                        next_before=next_before,
                         rag_on=(mode == "rag"), 
                         email=session.get("email"))
 
+def history_page(user_uid, before=None, limit=HISTORY_PAGE_SIZE):
+    # Keyset pagination over ix_message_user_uid_id, newest first. Returns the
+    # page and the id to pass as `before` for the next (older) page.
+    query = Message.query.filter(Message.user_uid == user_uid)
+    if before is not None:
+        query = query.filter(Message.id < before)
+    messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    next_before = messages[limit - 1].id if len(messages) > limit else None
+    return messages[:limit], next_before
+
+@app.route("/history")
+def history():
+    if "user_uid" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    before = request.args.get("before", type=int)
+    limit = max(1, min(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), 200))
+    messages, next_before = history_page(session["user_uid"], before, limit)
+    return jsonify({"messages": [m.to_dict() for m in messages], "next_before": next_before})
+
+def sse(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    if "user_uid" not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    user_uid = session["user_uid"]
+    mode = session.get("mode", "chat")
+    user_message = request.form.get("message", "").strip()
+    if not user_message:
+        return jsonify({"error": "Empty message"}), 400
+    
+    cached_reply, cache_key = lookup_reply(user_message, user_uid, mode)
+    prompt = build_prompt(user_message, user_uid, mode) if cached_reply is None else None
+    # Don't hold the SQLite write lock (e.g. embedding cache inserts) while
+    # the reply streams.
+    db.session.commit()
+    
+    def generate():
+        formatter = StreamingFormatter()
+        reply = ""
+        try:
+            if cached_reply is not None:
+                reply = cached_reply
+                yield sse({"delta": reply})
+            else:
+                failed = False
+                try:
+                    for text in tracer.iterate("gemini_stream", stream_gemini(prompt)):
+                        piece = formatter.feed(text)
+                        if piece:
+                            reply += piece
+                            yield sse({"delta": piece})
+                except Exception as e:
+                    # Already counted as a gemini_stream error by tracer.iterate
+                    print(f"Gemini stream error: {e}")
+                    failed = True
+                piece = formatter.finish()
+                if piece:
+                    reply += piece
+                    yield sse({"delta": piece})
+                if failed or not reply:
+                    # Keep what did arrive but mark it as cut short, and
+                    # don't cache it.
+                    reply = f"{reply}\n\n{GEMINI_ERROR_REPLY}" if reply else GEMINI_ERROR_REPLY
+                    yield sse({"reply": reply}, event="error")
+                    return
+                remember_reply(cache_key, reply)
+            yield sse({"reply": reply}, event="done")
+        finally:
+            # Runs on completion and when the client disconnects mid-stream.
+            db.session.add(Message(user_uid=user_uid, text=user_message, sender="user"))
+            if reply:
+                db.session.add(Message(user_uid=user_uid, text=reply, sender="bot"))
+            db.session.commit()
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+registry.collector("chatbot_embedding_cache_lookups_total", "Embedding cache lookups by result", ["result"],
+                   lambda: {(name,): n for name, n in embedding_cache.stats().items()
+                            if name in ("memory_hits", "store_hits", "misses")}, type="counter")
+registry.collector("chatbot_embedding_cache_entries", "Embeddings held in memory", [],
+                   lambda: {(): embedding_cache.stats()["size"]})
+if response_cache is not None:
+    registry.collector("chatbot_response_cache_lookups_total", "Response cache lookups by result", ["result"],
+                       lambda: {(name,): n for name, n in response_cache.stats().items() if name != "size"},
+                       type="counter")
+    registry.collector("chatbot_response_cache_entries", "Cached replies", [],
+                       lambda: {(): response_cache.stats()["size"]})
+registry.collector("chatbot_circuit_breaker_state", "Upstream circuit breaker: 0 closed, 1 half-open, 2 open",
+                   ["host"], lambda: {(host,): ("closed", "half-open", "open").index(breaker.state)
+                                      for host, breaker in list(upstream.breakers.items())})
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/set_mode", methods=["POST"])
 def set_mode():
     mode = request.form.get("mode", "chat")
@@ -353,6 +1311,7 @@ def set_mode():
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        init_db()
+    start_ingest_monitor()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
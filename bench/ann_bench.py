@@ -0,0 +1,85 @@
+"""Recall@K vs latency of the IVF / IVF-PQ index against exact search.
+
+    python bench/ann_bench.py --rows 50000 --k 3 --nprobe 4 8 16 32 --pq 0 32
+    python bench/ann_bench.py --shard vectors/<file>.vec
+
+Without --shard the vectors are synthetic: unit vectors scattered around
+random topic centres, queried with noisy copies of stored rows.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann import IVFIndex, top_k  # noqa: E402
+from vector_index import HEADER_SIZE, ShardStore, normalize_rows, record_dtype  # noqa: E402
+
+
+def synthetic(rows, dim, topics, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, rows)
+    return normalize_rows(centres[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32))
+
+
+def load_shard(path):
+    with open(path, "rb") as f:
+        dim = ShardStore.read_dim(f)
+    records = np.memmap(path, dtype=record_dtype(dim), mode="r", offset=HEADER_SIZE)
+    return np.asarray(records["vec"])
+
+
+def exact(matrix, query, k):
+    scores = np.nan_to_num(matrix @ query, nan=-np.inf)
+    return top_k(scores, k)
+
+
+def timed(search, queries):
+    start = time.perf_counter()
+    results = [search(q) for q in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shard", help="benchmark an existing .vec shard file")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, default=0, help="0: 4 * sqrt(rows)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--pq", type=int, nargs="+", default=[0, 32], help="PQ sub-vectors, 0: no PQ")
+    parser.add_argument("--rerank", type=int, default=16, help="PQ: re-score the best k * rerank exactly")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    matrix = load_shard(args.shard) if args.shard else synthetic(args.rows, args.dim, args.topics, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    valid = np.flatnonzero(np.isfinite(matrix[:, 0]))
+    picks = matrix[rng.choice(valid, args.queries)]
+    queries = normalize_rows(picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(matrix.shape[1]))
+    nlist = args.nlist or int(4 * np.sqrt(len(matrix)))
+    print(f"{len(matrix)} rows x {matrix.shape[1]} dims, {args.queries} queries, k={args.k}, nlist={nlist}")
+
+    truth, exact_ms = timed(lambda q: exact(matrix, q, args.k), queries)
+    print(f"{'index':<12}{'nprobe':>8}{'build s':>10}{'recall@k':>10}{'ms/query':>10}{'speedup':>9}")
+    print(f"{'exact':<12}{'-':>8}{'-':>10}{1.0:>10.3f}{exact_ms:>10.3f}{1.0:>9.1f}")
+    for pq_m in args.pq:
+        start = time.perf_counter()
+        index = IVFIndex(nlist, pq_m=pq_m, rerank=args.rerank, seed=args.seed).train(matrix)
+        build = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            found, ms = timed(lambda q: index.search(matrix, q, args.k, nprobe)[0], queries)
+            recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+            name = f"ivf-pq{pq_m}" if pq_m else "ivf"
+            print(f"{name:<12}{nprobe:>8}{build:>10.1f}{recall:>10.3f}{ms:>10.3f}{exact_ms / ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
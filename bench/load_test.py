@@ -0,0 +1,233 @@
+"""Concurrent load test for a running app (see bench/stub_server.py).
+
+    python bench/load_test.py --url http://127.0.0.1:5000 --users 20 --duration 60
+    python bench/load_test.py --output run.json --compare baseline.json
+
+Each virtual user logs in, uploads synthetic PDF/DOCX/TXT documents of the
+given sizes and waits for ingestion, then chats until the deadline, mixing
+plain and RAG mode and blocking and streaming replies. Throughput and
+p50/p95/p99 latency are reported per endpoint; with --compare the run fails
+when an endpoint's p95 is more than --tolerance slower than the baseline.
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import docx
+import fitz
+import httpx
+import numpy as np
+
+TOPICS = {
+    "billing": "invoice payment refund subscription charge receipt currency tax discount",
+    "network": "router latency bandwidth packet firewall dns gateway throughput subnet",
+    "storage": "disk volume snapshot backup replica quota archive retention bucket",
+    "security": "password token certificate encryption audit access role breach policy",
+    "deploy": "release rollback container cluster pipeline canary staging version build",
+}
+FILLER = "the a of and to in for with on by from about system team service customer report".split()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)  # endpoint -> [(seconds, ok)]
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples[endpoint].append((seconds, ok))
+
+    def timed(self, endpoint, call, check=lambda r: r.status_code < 400):
+        start = time.perf_counter()
+        try:
+            response = call()
+            ok = check(response)
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.add(endpoint, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    def summary(self, elapsed):
+        rows = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = np.array([s for s, _ in samples]) * 1000
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            rows[endpoint] = {"requests": len(samples), "errors": sum(not ok for _, ok in samples),
+                              "rps": len(samples) / elapsed, "mean_ms": float(latencies.mean()),
+                              "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+        return rows
+
+
+def sentence(rng, topic):
+    words = TOPICS[topic].split()
+    return " ".join(rng.choice(words if rng.random() < 0.4 else FILLER) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+
+def document_text(rng, size):
+    parts, length = [], 0
+    while length < size:
+        topic = rng.choice(list(TOPICS))
+        paragraph = " ".join(sentence(rng, topic) for _ in range(rng.randint(3, 8)))
+        parts.append(paragraph)
+        length += len(paragraph) + 2
+    return parts
+
+
+def make_file(rng, kind, size):
+    # Returns (filename, bytes) for a document with about `size` characters.
+    paragraphs = document_text(rng, size)
+    if kind == "txt":
+        return "bench.txt", "\n\n".join(paragraphs).encode("utf-8")
+    if kind == "docx":
+        document = docx.Document()
+        for paragraph in paragraphs:
+            document.add_paragraph(paragraph)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        return "bench.docx", buffer.getvalue()
+    pdf = fitz.open()
+    page_text = ""
+    for paragraph in paragraphs + [None]:
+        if paragraph is None or len(page_text) + len(paragraph) > 2500:
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(40, 40, 555, 800), page_text, fontsize=8)
+            page_text = ""
+        if paragraph is not None:
+            page_text += paragraph + "\n\n"
+    data = pdf.tobytes()
+    pdf.close()
+    return "bench.pdf", data
+
+
+def question(rng):
+    topic = rng.choice(list(TOPICS))
+    return f"What does the report say about {' and '.join(rng.sample(TOPICS[topic].split(), 2))}?"
+
+
+def read_stream(response):
+    # Consumes the SSE reply; True when it ended with the "done" event.
+    done = False
+    for line in response.iter_lines():
+        if line.startswith("event: done"):
+            done = True
+    return done
+
+
+def virtual_user(n, args, recorder):
+    rng = random.Random(args.seed + n)
+    with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+        email = f"bench{n}@example.com"
+        login = recorder.timed("POST /login", lambda: client.post(
+            "/login", data={"email": email, "password": "bench-password"}),
+            check=lambda r: r.status_code == 302 and r.headers.get("location", "").endswith("/chat"))
+        if login is None:
+            return
+
+        for i in range(args.files):
+            kind = args.formats[(n + i) % len(args.formats)]
+            size = args.sizes[(n + i) % len(args.sizes)] * 1024
+            filename, data = make_file(rng, kind, size)
+            response = recorder.timed(f"POST /upload ({kind})", lambda: client.post(
+                "/upload", files={"file": (filename, data)}, headers={"Accept": "application/json"}))
+            if response is None:
+                continue
+            start, status_url = time.perf_counter(), response.json()["status_url"]
+            while time.perf_counter() - start < args.timeout:
+                status = recorder.timed("GET /jobs/<id>", lambda: client.get(status_url))
+                if status is not None and status.json()["status"] not in ("queued", "running"):
+                    recorder.add(f"ingest ({kind})", time.perf_counter() - start, status.json()["status"] == "done")
+                    break
+                time.sleep(0.5)
+
+        # The chat window starts once this user's documents are ingested.
+        mode, deadline = None, time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            wanted = "rag" if rng.random() < args.rag_ratio else "chat"
+            if wanted != mode:
+                if recorder.timed("POST /set_mode", lambda: client.post("/set_mode", data={"mode": wanted}),
+                                  check=lambda r: r.status_code == 302) is None:
+                    continue
+                mode = wanted
+            message = question(rng)
+            if rng.random() < args.stream_ratio:
+                def call():
+                    with client.stream("POST", "/chat/stream", data={"message": message}) as response:
+                        return response.status_code == 200 and read_stream(response)
+                recorder.timed(f"POST /chat/stream ({mode})", call, check=bool)
+            else:
+                recorder.timed(f"POST /chat ({mode})", lambda: client.post("/chat", data={"message": message}))
+            if args.think:
+                time.sleep(rng.uniform(0, 2 * args.think))
+
+
+def print_table(rows):
+    print(f"{'endpoint':<28}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in rows.items():
+        print(f"{endpoint:<28}{row['requests']:>9}{row['errors']:>8}{row['rps']:>8.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+
+def compare(rows, baseline, tolerance):
+    regressions = []
+    for endpoint, row in rows.items():
+        before = baseline.get(endpoint)
+        if before and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms")
+        if before and row["errors"] / row["requests"] > before["errors"] / before["requests"] + tolerance / 10:
+            regressions.append(f"{endpoint}: error rate {before['errors']}/{before['requests']}"
+                               f" -> {row['errors']}/{row['requests']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of chatting after the uploads")
+    parser.add_argument("--files", type=int, default=1, help="documents uploaded per user")
+    parser.add_argument("--formats", nargs="+", default=["txt", "pdf", "docx"], choices=["txt", "pdf", "docx"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 64, 256], help="document sizes in KB")
+    parser.add_argument("--rag-ratio", type=float, default=0.5, help="fraction of chats in RAG mode")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="fraction of chats using /chat/stream")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between chats, seconds")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown for --compare")
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(virtual_user, n, args, recorder) for n in range(args.users)]
+        for n, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Virtual user {n} failed: {e}", file=sys.stderr)
+    elapsed = time.monotonic() - start
+
+    rows = recorder.summary(elapsed)
+    print(f"{args.users} users, {elapsed:.1f} s")
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "elapsed": elapsed, "endpoints": rows}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(rows, json.load(f)["endpoints"], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Local stand-in for the Firebase Auth and Gemini APIs used by app.py.
+
+    python bench/stub_server.py --port 8090 --latency 0.2 --error-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8090/v1beta \\
+    FIREBASE_AUTH_URL=http://127.0.0.1:8090/v1 python app.py
+
+Any email/password signs up and logs in. Embeddings are hashed bags of words,
+so chunks sharing words with a question are also close in vector space and
+RAG retrieval behaves plausibly. Every call waits `--latency` seconds
+(+/- `--jitter`) and fails with 503 or 429 at the given rates.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+WORD = re.compile(r"\w+")
+ROUTE = re.compile(r"^/(?P<version>v1beta|v1)/(?:models/[^/:]+|accounts):(?P<method>\w+)$")
+
+
+def embed(text, dim):
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        h = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:8], "little")
+        vector[h % dim] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def reply_text(prompt, words):
+    # A canned markdown answer of roughly `words` words echoing the question.
+    question = prompt.rsplit("Question:", 1)[-1].strip()[:200]
+    body = " ".join(WORD.findall(prompt.lower())[:words]) or "nothing"
+    return f"## Answer\n\n**Question:** {question}\n\n- {body}\n- This reply comes from the stub server."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None  # argparse namespace, set in main()
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def delay(self, scale=1.0):
+        options = self.options
+        time.sleep(max(0.0, (options.latency + random.uniform(-options.jitter, options.jitter)) * scale))
+
+    def inject_failure(self):
+        roll = random.random()
+        if roll < self.options.error_rate:
+            self.send_json(503, {"error": {"code": 503, "message": "Stub server error", "status": "UNAVAILABLE"}})
+            return True
+        if roll < self.options.error_rate + self.options.rate_limit_rate:
+            self.send_json(429, {"error": {"code": 429, "message": "Stub rate limit", "status": "RESOURCE_EXHAUSTED"}},
+                           {"Retry-After": "1"})
+            return True
+        return False
+
+    def do_POST(self):
+        match = ROUTE.match(urlsplit(self.path).path)
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": {"code": 400, "message": "Invalid JSON"}})
+        if match is None:
+            return self.send_json(404, {"error": {"code": 404, "message": f"No stub for {self.path}"}})
+
+        method = match.group("method")
+        if method == "streamGenerateContent":
+            return self.stream(payload)
+        self.delay()
+        if self.inject_failure():
+            return
+        handler = getattr(self, "handle_" + method, None)
+        if handler is None:
+            return self.send_json(404, {"error": {"code": 404, "message": f"No stub for {method}"}})
+        self.send_json(200, handler(payload))
+
+    def handle_signUp(self, payload):
+        return self.handle_signInWithPassword(payload)
+
+    def handle_signInWithPassword(self, payload):
+        email = payload.get("email", "")
+        return {"localId": hashlib.sha1(email.encode("utf-8")).hexdigest()[:28], "email": email,
+                "idToken": "stub-token", "refreshToken": "stub-refresh", "expiresIn": "3600"}
+
+    def handle_generateContent(self, payload):
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        return {"candidates": [{"content": {"parts": [{"text": reply_text(prompt, self.options.reply_words)}],
+                                            "role": "model"}, "finishReason": "STOP"}]}
+
+    def handle_embedContent(self, payload):
+        return {"embedding": {"values": embed(payload["content"]["parts"][0]["text"], self.options.dim)}}
+
+    def handle_batchEmbedContents(self, payload):
+        return {"embeddings": [{"values": embed(r["content"]["parts"][0]["text"], self.options.dim)}
+                               for r in payload.get("requests", [])]}
+
+    def stream(self, payload):
+        # First token after the usual latency, the rest spread over
+        # `--stream-chunks` server-sent events.
+        self.delay()
+        if self.inject_failure():
+            return
+        text = reply_text(payload["contents"][0]["parts"][0]["text"], self.options.reply_words)
+        size = max(1, len(text) // self.options.stream_chunks)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(text), size):
+            if i:
+                self.delay(self.options.stream_interval)
+            event = {"candidates": [{"content": {"parts": [{"text": text[i:i + size]}], "role": "model"}}]}
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="+/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--stream-chunks", type=int, default=10)
+    parser.add_argument("--stream-interval", type=float, default=0.1,
+                        help="delay between streamed chunks, as a fraction of the latency")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    StubHandler.options = parser.parse_args()
+
+    server = ThreadingHTTPServer((StubHandler.options.host, StubHandler.options.port), StubHandler)
+    server.daemon_threads = True
+    print(f"Stub server listening on http://{StubHandler.options.host}:{StubHandler.options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
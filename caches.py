@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    # Thread-safe, size-bounded mapping that forgets the least recently used
+    # entries first.
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class EmbeddingCache:
+    # Content-addressed embedding cache: sha256(model, normalized text) ->
+    # float32 vector. An in-memory LRU sits in front of a persistent store
+    # reached through `load(keys) -> {key: bytes}` and `save({key: bytes})`.
+    def __init__(self, model, maxsize, load, save):
+        self.model = model
+        self.memory = LRUCache(maxsize)
+        self.load = load
+        self.save = save
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def key(self, text):
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _count(self, name, n):
+        if n:
+            with self._lock:
+                self.counters[name] += n
+
+    def get_many(self, texts):
+        """Returns one cached vector (or None) per text."""
+        keys = [self.key(text) for text in texts]
+        results = [self.memory.get(key) for key in keys]
+        self._count("memory_hits", sum(r is not None for r in results))
+        missing = {key for key, r in zip(keys, results) if r is None}
+        stored = self.load(list(missing)) if missing else {}
+        for i, key in enumerate(keys):
+            if results[i] is None and key in stored:
+                results[i] = np.frombuffer(stored[key], dtype=np.float32)
+                self.memory.put(key, results[i])
+                self._count("store_hits", 1)
+        self._count("misses", sum(r is None for r in results))
+        return results
+
+    def put_many(self, texts, vectors):
+        items = {}
+        for text, vector in zip(texts, vectors):
+            if vector is not None and np.size(vector):
+                vector = np.asarray(vector, dtype=np.float32)
+                key = self.key(text)
+                self.memory.put(key, vector)
+                items[key] = vector.tobytes()
+        if items:
+            self.save(items)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = sum(stats.values())
+        stats["size"] = len(self.memory)
+        stats["hit_rate"] = (stats["memory_hits"] + stats["store_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+class ResponseCache:
+    # Cache of chat replies with an exact layer (normalized prompt text) and
+    # an optional semantic layer that reuses the reply of the most similar
+    # cached prompt when its cosine similarity is at least `threshold`.
+    # Entries live in a `scope` (e.g. per user and document version) and are
+    # only matched within it. Expired entries are dropped on access and the
+    # least recently used ones once `maxsize` is exceeded.
+    def __init__(self, maxsize, ttl, threshold):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        self._entries = OrderedDict()  # key -> (scope, reply, unit vector, expires)
+        self._scopes = {}  # scope -> set of keys
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self):
+        return self.threshold < 1
+
+    @staticmethod
+    def key(scope, text):
+        normalized = " ".join(text.casefold().split())
+        return hashlib.sha256(f"{scope}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remove(self, key):
+        scope = self._entries.pop(key)[0]
+        keys = self._scopes[scope]
+        keys.discard(key)
+        if not keys:
+            del self._scopes[scope]
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry[3] <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, scope, text, vector=None):
+        now = time.monotonic()
+        key = self.key(scope, text)
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["exact_hits"] += 1
+                return entry[1]
+            if self.semantic and vector is not None and np.size(vector):
+                candidates = [k for k in list(self._scopes.get(scope, ()))
+                              if self._live(k, now) is not None and self._entries[k][2] is not None]
+                if candidates:
+                    query = np.asarray(vector, dtype=np.float32)
+                    query = query / (np.linalg.norm(query) or 1)
+                    vectors = [self._entries[k][2] for k in candidates]
+                    scores = np.array([v @ query if v.size == query.size else -1.0 for v in vectors])
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        self._entries.move_to_end(candidates[best])
+                        self.counters["semantic_hits"] += 1
+                        return self._entries[candidates[best]][1]
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, scope, text, reply, vector=None):
+        if vector is not None and np.size(vector):
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1)
+        else:
+            vector = None
+        key = self.key(scope, text)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (scope, reply, vector, time.monotonic() + self.ttl)
+            self._scopes.setdefault(scope, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, scope_prefix):
+        with self._lock:
+            for scope in [s for s in self._scopes if s.startswith(scope_prefix)]:
+                for key in list(self._scopes.get(scope, ())):
+                    self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self._entries)
+        return stats
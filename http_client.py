@@ -0,0 +1,167 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures and rejects calls for
+    # `cooldown` seconds, then lets a single trial call through (half-open):
+    # success closes the circuit, failure opens it again.
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class HttpClient:
+    # Shared keep-alive client for upstream APIs: one pooled httpx.Client
+    # (HTTP/2 when available) for all threads, retries with jittered
+    # exponential backoff, and a circuit breaker per host. `observe(url,
+    # status, seconds, sent, received)` is called for every attempt; status
+    # is the HTTP status code or "transport_error" / "circuit_open".
+    def __init__(self, max_connections=100, max_keepalive=20, keepalive_expiry=30.0,
+                 timeout=15.0, connect_timeout=5.0, retries=2, backoff=0.5,
+                 breaker_threshold=5, breaker_cooldown=30.0, http2=True, observe=None):
+        self.retries = retries
+        self.observe = observe
+        self.backoff = backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.client = httpx.Client(
+            http2=http2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self.breakers[host]
+
+    def _check(self, url):
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            self._observe(url, "circuit_open", 0.0)
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+        return breaker
+
+    def _observe(self, url, status, seconds, response=None):
+        if self.observe is None:
+            return
+        sent = received = 0
+        if response is not None:
+            sent = int(response.request.headers.get("Content-Length") or 0)
+            received = response.num_bytes_downloaded
+        self.observe(url, status, seconds, sent, received)
+
+    def _sleep(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+        time.sleep(min(delay, 30))
+
+    def request(self, method, url, retries=None, **kwargs):
+        """Sends a request, retrying transport errors and 429/5xx responses.
+        The last response is returned as-is once retries run out."""
+        retries = self.retries if retries is None else retries
+        breaker = self._check(url)
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                self._observe(url, "transport_error", time.perf_counter() - start)
+                breaker.record_failure()
+                if attempt == retries:
+                    raise
+                self._sleep(attempt)
+                breaker = self._check(url)
+                continue
+            self._observe(url, response.status_code, time.perf_counter() - start, response)
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            self._sleep(attempt, response)
+            breaker = self._check(url)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method, url, **kwargs):
+        # Streaming responses are not retried: by the time a failure shows up
+        # part of the body may already have been passed on.
+        breaker = self._check(url)
+        start, status, response = time.perf_counter(), "transport_error", None
+        try:
+            with self.client.stream(method, url, **kwargs) as response:
+                status = response.status_code
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                yield response
+        except httpx.TransportError:
+            status = "transport_error"
+            breaker.record_failure()
+            raise
+        finally:
+            self._observe(url, status, time.perf_counter() - start, response)
@@ -0,0 +1,213 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _sorted(values):
+    # Label values may mix types (e.g. 200 and "transport_error").
+    return sorted(values.items(), key=lambda item: tuple(map(str, item[0])))
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in _sorted(self._values):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in _sorted(self._values)]
+        for labels, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                le = bound if bound == "+Inf" else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {total}")
+        return lines
+
+
+class Collector:
+    # Values read at scrape time from `collect() -> {labels tuple: value}`,
+    # for numbers another object already keeps (cache stats, breaker state).
+    def __init__(self, name, help, labels, collect, type="gauge"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.type = type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in _sorted(self.collect()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    # Process-local metrics rendered in the Prometheus text format. With
+    # several worker processes each one reports its own numbers.
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, help, labels, collect, type="gauge"):
+        return self.add(Collector(name, help, labels, collect, type))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    # Times named stages into `histogram` (labelled by stage). Durations are
+    # exclusive of nested stages, so the stages of one request add up to at
+    # most its total time. Between `begin()` and `end()` the current thread
+    # also collects per-stage totals for a request log line.
+    def __init__(self, histogram, errors):
+        self.histogram = histogram
+        self.errors = errors
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.stages = {}
+        self._local.stack = []
+
+    def end(self):
+        stages = getattr(self._local, "stages", None)
+        self._local.stages = None
+        return stages or {}
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def start(self, stage):
+        self._stack().append([stage, time.perf_counter(), 0.0])
+
+    def stop(self, failed=False):
+        stack = self._stack()
+        if not stack:
+            return
+        stage, start, nested = stack.pop()
+        elapsed = time.perf_counter() - start
+        if stack:
+            stack[-1][2] += elapsed
+        own = elapsed - nested
+        self.histogram.observe(own, stage)
+        stages = getattr(self._local, "stages", None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + own
+        if failed:
+            self.errors.inc(1, stage)
+
+    @contextmanager
+    def timed(self, stage):
+        # An exception counts as an error of the innermost stage it leaves;
+        # outer stages it only passes through just record their time.
+        self.start(stage)
+        try:
+            yield
+        except BaseException as e:
+            self.stop(failed=self._claim(e))
+            raise
+        self.stop()
+
+    @staticmethod
+    def _claim(exception):
+        # True the first time a stage sees `exception`.
+        if getattr(exception, "_stage_error", False):
+            return False
+        exception._stage_error = True
+        return True
+
+    def wrap(self, stage):
+        """Decorator form of `timed`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timed(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def iterate(self, stage, iterable):
+        # Times only the work done producing each item, not the consumer's.
+        iterator, done = iter(iterable), object()
+        while True:
+            with self.timed(stage):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def error(self, stage, exception=None):
+        # With `exception`, skips errors a timed stage has already counted.
+        if exception is None or self._claim(exception):
+            self.errors.inc(1, stage)
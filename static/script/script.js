@@ -18,7 +18,11 @@ document.addEventListener('DOMContentLoaded', function() {
         const content = element.getAttribute('data-content');
         element.innerHTML = renderMarkdown(content);
     });
+    // Jump (not smooth-scroll) to the bottom so the history loader isn't triggered
+    const chatContainer = document.getElementById('chatContainer');
+    chatContainer.style.scrollBehavior = 'auto';
     scrollToBottom();
+    chatContainer.style.scrollBehavior = '';
 });
 
 // Handle form submission
@@ -36,23 +40,18 @@ document.getElementById('chatForm').addEventListener('submit', function(e) {
     document.getElementById('loadingIndicator').style.display = 'block';
     scrollToBottom();
 
-    fetch(CHAT_URL, {
+    fetch(CHAT_STREAM_URL, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/x-www-form-urlencoded',
         },
         body: 'message=' + encodeURIComponent(message)
     })
-    .then(response => response.json())
-    .then(data => {
-        document.getElementById('loadingIndicator').style.display = 'none';
-
-        if (data.reply) {
-            addMessage('bot', data.reply);
-        } else if (data.error) {
-            addMessage('bot', '⚠️ ' + data.error);
+    .then(response => {
+        if (!response.ok || !response.body) {
+            return response.json().then(data => { throw new Error(data.error || 'Request failed'); });
         }
-        scrollToBottom();
+        return readReplyStream(response.body);
     })
     .catch(error => {
         document.getElementById('loadingIndicator').style.display = 'none';
@@ -62,8 +61,71 @@ document.getElementById('chatForm').addEventListener('submit', function(e) {
     });
 });
 
+// Read Server-Sent Events from the reply stream and render markdown as it arrives
+function readReplyStream(body) {
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let reply = '';
+    let target = null;
+    let renderPending = false;
+
+    function render() {
+        renderPending = false;
+        target.innerHTML = renderMarkdown(reply);
+        scrollToBottom();
+    }
+
+    function handleEvent(raw) {
+        let event = 'message';
+        let data = '';
+        raw.split('\n').forEach(line => {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+        });
+        if (!data) return;
+        const payload = JSON.parse(data);
+
+        if (!target) {
+            document.getElementById('loadingIndicator').style.display = 'none';
+            target = addMessage('bot', '').querySelector('.bot-response');
+        }
+        if (event === 'done' || event === 'error') {
+            reply = payload.reply;
+            render();
+        } else if (payload.delta) {
+            reply += payload.delta;
+            if (!renderPending) {
+                renderPending = true;
+                requestAnimationFrame(render);
+            }
+        }
+    }
+
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            if (done) return;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                handleEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
 function addMessage(sender, text) {
     const chatContainer = document.getElementById('chatContainer');
+    const messageDiv = buildMessage(sender, text);
+    chatContainer.appendChild(messageDiv);
+    return messageDiv;
+}
+
+function buildMessage(sender, text) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}-message`;
 
@@ -73,9 +135,41 @@ function addMessage(sender, text) {
         messageDiv.innerHTML = `<strong>AI:</strong> <div class="bot-response">${renderMarkdown(text)}</div>`;
     }
 
-    chatContainer.appendChild(messageDiv);
+    return messageDiv;
 }
 
+// Load older messages when the user scrolls to the top of the chat
+let loadingHistory = false;
+
+function loadOlderMessages() {
+    const chatContainer = document.getElementById('chatContainer');
+    const before = chatContainer.dataset.nextBefore;
+    if (loadingHistory || !before) return;
+    loadingHistory = true;
+
+    fetch(`${HISTORY_URL}?before=${before}`)
+        .then(response => response.json())
+        .then(data => {
+            // Keep the visible messages in place while older ones are prepended
+            const previousHeight = chatContainer.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.slice().reverse().forEach(message => {
+                fragment.appendChild(buildMessage(message.sender === 'user' ? 'user' : 'bot', message.text));
+            });
+            chatContainer.insertBefore(fragment, chatContainer.firstChild);
+            chatContainer.style.scrollBehavior = 'auto';
+            chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+            chatContainer.style.scrollBehavior = '';
+            chatContainer.dataset.nextBefore = data.next_before || '';
+        })
+        .catch(error => console.error('Error:', error))
+        .finally(() => { loadingHistory = false; });
+}
+
+document.getElementById('chatContainer').addEventListener('scroll', function() {
+    if (this.scrollTop < 50) loadOlderMessages();
+});
+
 function scrollToBottom() {
     const chatContainer = document.getElementById('chatContainer');
     chatContainer.scrollTop = chatContainer.scrollHeight;
@@ -97,44 +191,80 @@ function viewDocuments() {
     loadDocumentsList();
 }
 
+// Last first page of the documents list, revalidated with its ETag
+let documentsCache = { etag: null, data: null };
+
 // Separate function to load documents list without creating new modal
 function loadDocumentsList() {
     const content = document.getElementById('documentsContent');
-    content.innerHTML = '<div class="text-center"><div class="spinner-border" role="status"><span class="visually-hidden">Loading...</span></div></div>';
+    if (!documentsCache.data) {
+        content.innerHTML = '<div class="text-center"><div class="spinner-border" role="status"><span class="visually-hidden">Loading...</span></div></div>';
+    }
 
-    fetch(DOCUMENTS_URL)
-        .then(response => response.json())
-        .then(data => {
-            if (data.documents && data.documents.length > 0) {
-                let html = '';
-                data.documents.forEach(doc => {
-                    html += `
-                        <div class="document-item">
-                            <div class="d-flex justify-content-between align-items-start">
-                                <div class="flex-grow-1">
-                                    <h6 class="mb-1">📄 ${doc.filename}</h6>
-                                    <small class="text-muted">${doc.chunk_count} chunks</small>
-                                    <div class="document-preview">${doc.content_preview}</div>
-                                </div>
-                                <button class="btn btn-outline-danger btn-sm ms-2" 
-                                        onclick="deleteDocument(${doc.id}, '${doc.filename}')">
-                                    🗑️ Delete
-                                </button>
-                            </div>
-                        </div>
-                    `;
-                });
-                content.innerHTML = html;
-            } else {
-                content.innerHTML = '<div class="text-center text-muted">No documents uploaded yet.</div>';
-            }
+    fetch(DOCUMENTS_URL, {
+        cache: 'no-store',
+        headers: documentsCache.etag ? { 'If-None-Match': documentsCache.etag } : {}
+    })
+        .then(response => {
+            if (response.status === 304) return documentsCache.data;
+            documentsCache.etag = response.headers.get('ETag');
+            return response.json().then(data => (documentsCache.data = data));
         })
+        .then(data => renderDocuments(data, false))
         .catch(error => {
             console.error('Error:', error);
             content.innerHTML = '<div class="text-center text-danger">Error loading documents.</div>';
         });
 }
 
+function loadMoreDocuments(before) {
+    fetch(`${DOCUMENTS_URL}?before=${before}`, { cache: 'no-store' })
+        .then(response => response.json())
+        .then(data => renderDocuments(data, true))
+        .catch(error => console.error('Error:', error));
+}
+
+function renderDocuments(data, append) {
+    const content = document.getElementById('documentsContent');
+    const moreButton = document.getElementById('moreDocuments');
+    if (moreButton) moreButton.remove();
+
+    if (!append && !(data.documents && data.documents.length > 0)) {
+        content.innerHTML = '<div class="text-center text-muted">No documents uploaded yet.</div>';
+        return;
+    }
+
+    let html = '';
+    data.documents.forEach(doc => {
+        html += `
+            <div class="document-item">
+                <div class="d-flex justify-content-between align-items-start">
+                    <div class="flex-grow-1">
+                        <h6 class="mb-1">📄 ${escapeHtml(doc.filename)}</h6>
+                        <small class="text-muted">${doc.chunk_count} chunks</small>
+                        <div class="document-preview">${escapeHtml(doc.content_preview)}</div>
+                    </div>
+                    <button class="btn btn-outline-danger btn-sm ms-2" 
+                            onclick="deleteDocument(${doc.id}, '${doc.filename}')">
+                        🗑️ Delete
+                    </button>
+                </div>
+            </div>
+        `;
+    });
+    if (data.next_before) {
+        html += `<div class="text-center" id="moreDocuments">
+                    <button class="btn btn-outline-secondary btn-sm" onclick="loadMoreDocuments(${data.next_before})">Load more</button>
+                 </div>`;
+    }
+
+    if (append) {
+        content.insertAdjacentHTML('beforeend', html);
+    } else {
+        content.innerHTML = html;
+    }
+}
+
 // Delete Document Function
 function deleteDocument(docId, filename) {
     if (confirm(`Are you sure you want to delete "${filename}"?`)) {
@@ -156,6 +286,65 @@ function deleteDocument(docId, filename) {
     }
 }
 
+// Upload Function: queue the file and poll the ingestion job for progress
+const uploadForm = document.getElementById('uploadForm');
+if (uploadForm) {
+    uploadForm.addEventListener('submit', function(e) {
+        e.preventDefault();
+
+        const status = document.getElementById('uploadStatus');
+        const button = uploadForm.querySelector('button[type="submit"]');
+        button.disabled = true;
+        status.className = 'small mt-1 text-muted';
+        status.textContent = 'Uploading...';
+
+        fetch(UPLOAD_URL, {
+            method: 'POST',
+            headers: { 'Accept': 'application/json' },
+            body: new FormData(uploadForm)
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) throw new Error(data.error);
+            uploadForm.reset();
+            pollJob(data.status_url, status, button);
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            button.disabled = false;
+            status.className = 'small mt-1 text-danger';
+            status.textContent = '⚠️ ' + (error.message || 'Upload failed');
+        });
+    });
+}
+
+function pollJob(statusUrl, status, button) {
+    fetch(statusUrl)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'done') {
+                button.disabled = false;
+                status.className = 'small mt-1 text-success';
+                status.textContent = `✅ ${job.filename}: created ${job.embeddings} searchable chunks.`;
+            } else if (job.status === 'failed' || job.error) {
+                button.disabled = false;
+                status.className = 'small mt-1 text-danger';
+                status.textContent = `⚠️ ${job.filename || 'Upload'}: ${job.error}`;
+            } else if (job.status === 'queued') {
+                status.textContent = `Waiting to process ${job.filename}...`;
+                setTimeout(() => pollJob(statusUrl, status, button), 1000);
+            } else {
+                status.textContent = `Processing ${job.filename}: ${job.pages} pages, ` +
+                    `${job.chunks} chunks, ${job.embeddings} embeddings...`;
+                setTimeout(() => pollJob(statusUrl, status, button), 1000);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            setTimeout(() => pollJob(statusUrl, status, button), 3000);
+        });
+}
+
 // Clear History Function
 function clearHistory() {
     const modal = new bootstrap.Modal(document.getElementById('clearHistoryModal'));
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The app is a set of top-level modules rather than a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the tests out of the working tree's database.
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="chatbot-tests-"), "chatbot.db"))
+
+
+@pytest.fixture(scope="session")
+def database():
+    import app
+    with app.app.app_context():
+        app.init_db()
+    return app.db
+
+
+@pytest.fixture
+def login(database):
+    """Returns a test client signed in as a new user, and the user's uid."""
+    import app
+
+    def login():
+        user_uid = uuid.uuid4().hex
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session["user_uid"] = user_uid
+        return client, user_uid
+    return login
@@ -0,0 +1,92 @@
+import numpy as np
+
+import caches
+from caches import EmbeddingCache, LRUCache, ResponseCache
+
+
+def dict_store():
+    store, loads = {}, []
+
+    def load(keys):
+        loads.append(sorted(keys))
+        return {key: store[key] for key in keys if key in store}
+
+    return store, loads, load, store.update
+
+
+def test_lru_cache_forgets_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_embedding_cache_memory_store_and_miss():
+    store, loads, load, save = dict_store()
+    cache = EmbeddingCache("model", 10, load, save)
+    assert cache.get_many(["hello  world"]) == [None]
+
+    cache.put_many(["hello  world", "empty"], [np.array([1.0, 2.0]), np.array([])])
+    assert len(store) == 1  # empty vectors are never cached
+    hit, = cache.get_many(["hello world"])  # same text after whitespace normalization
+    assert hit.dtype == np.float32 and hit.tolist() == [1.0, 2.0]
+
+    # A new process finds it in the persistent store, then in memory.
+    other = EmbeddingCache("model", 10, load, save)
+    loads.clear()
+    assert other.get_many([" hello world "])[0].tolist() == [1.0, 2.0]
+    assert other.get_many(["hello world"])[0].tolist() == [1.0, 2.0]
+    assert len(loads) == 1
+    assert other.stats()["memory_hits"] == 1 and other.stats()["store_hits"] == 1
+
+
+def test_embedding_cache_keys_depend_on_model():
+    store, _, load, save = dict_store()
+    EmbeddingCache("model-a", 10, load, save).put_many(["text"], [np.ones(3)])
+    assert EmbeddingCache("model-b", 10, load, save).get_many(["text"]) == [None]
+
+
+def test_response_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(caches.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(10, ttl=60, threshold=1)
+    cache.put("chat", "Hello there", "Hi!")
+    assert cache.get("chat", "  hello THERE ") == "Hi!"
+    now[0] += 61
+    assert cache.get("chat", "hello there") is None
+    assert cache.stats() == {"exact_hits": 1, "semantic_hits": 0, "misses": 1, "size": 0}
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(2, ttl=60, threshold=1)
+    cache.put("chat", "a", "1")
+    cache.put("chat", "b", "2")
+    assert cache.get("chat", "a") == "1"
+    cache.put("chat", "c", "3")
+    assert cache.get("chat", "b") is None
+    assert cache.get("chat", "a") == "1" and cache.get("chat", "c") == "3"
+
+
+def test_response_cache_scopes_and_invalidation():
+    cache = ResponseCache(10, ttl=60, threshold=1)
+    cache.put("rag:u1:v1", "question", "answer 1")
+    cache.put("rag:u2:v1", "question", "answer 2")
+    assert cache.get("rag:u1:v2", "question") is None
+    cache.invalidate("rag:u1:")
+    assert cache.get("rag:u1:v1", "question") is None
+    assert cache.get("rag:u2:v1", "question") == "answer 2"
+
+
+def test_response_cache_semantic_layer_only_below_threshold_one():
+    exact = ResponseCache(10, ttl=60, threshold=1)
+    assert not exact.semantic
+    exact.put("chat", "what is a cat", "A cat.", np.array([1.0, 0.0]))
+    assert exact.get("chat", "what's a cat", np.array([1.0, 0.01])) is None
+
+    semantic = ResponseCache(10, ttl=60, threshold=0.95)
+    semantic.put("chat", "what is a cat", "A cat.", np.array([1.0, 0.0]))
+    assert semantic.get("chat", "what's a cat", np.array([1.0, 0.01])) == "A cat."
+    assert semantic.get("chat", "what is a dog", np.array([0.0, 1.0])) is None
+    assert semantic.get("other", "what's a cat", np.array([1.0, 0.01])) is None
@@ -0,0 +1,73 @@
+import docx
+import fitz
+import pytest
+
+import app
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda".split()
+
+
+def sample_text(n_sentences):
+    sentences = []
+    for i in range(n_sentences):
+        words = [WORDS[(i * 7 + j) % len(WORDS)] for j in range(5 + i % 23)]
+        end = "\n\n" if i % 9 == 8 else " "
+        sentences.append(" ".join(words).capitalize() + ".!?"[i % 3] + end)
+    return "".join(sentences)
+
+
+def rebuild(pages):
+    chunks = list(app.iter_chunks(pages))
+    for chunk, _ in chunks:
+        assert chunk and len(chunk) <= app.CHUNK_SIZE
+    return chunks, "".join(new_text for _, new_text in chunks)
+
+
+@pytest.mark.parametrize("size,overlap", [(800, 100), (120, 40), (30, 0)])
+def test_chunks_rebuild_text_split_at_arbitrary_points(monkeypatch, size, overlap):
+    monkeypatch.setattr(app, "CHUNK_SIZE", size)
+    monkeypatch.setattr(app, "CHUNK_OVERLAP", overlap)
+    text = sample_text(300) + "x" * 250 + " trailing words without a full stop"
+    # Page breaks in the middle of words and sentences.
+    pages = [text[i:i + 97] for i in range(0, len(text), 97)]
+    chunks, rebuilt = rebuild(pages)
+    assert rebuilt == text
+    assert len(chunks) > 1
+
+
+def test_txt_blocks_do_not_split_words(tmp_path):
+    path = tmp_path / "doc.txt"
+    # A word straddles the 64 KiB block boundary.
+    text = "a" * (64 * 1024 - 3) + " straddling word. " + sample_text(100)
+    path.write_text(text, encoding="utf-8")
+    blocks = list(app.iter_pages(str(path)))
+    assert len(blocks) == 2
+    assert "".join(blocks) == text
+    _, rebuilt = rebuild(blocks)
+    assert rebuilt == text
+    assert " straddling " in rebuilt
+
+
+def test_docx_paragraphs_are_separated(tmp_path):
+    path = tmp_path / "doc.docx"
+    document = docx.Document()
+    paragraphs = ["First paragraph without a full stop", "Second one.", "", "Third paragraph ends here."]
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+    _, rebuilt = rebuild(app.iter_pages(str(path)))
+    assert rebuilt == "".join(p + "\n" for p in paragraphs if p)
+
+
+def test_pdf_pages_are_separated(tmp_path):
+    path = tmp_path / "doc.pdf"
+    pdf = fitz.open()
+    for text in ["Page one ends mid", "sentence on page two."]:
+        pdf.new_page().insert_text((72, 72), text)
+    pdf.save(path)
+    pdf.close()
+    pages = list(app.iter_pages(str(path)))
+    assert len(pages) == 2 and all(page.endswith("\n") for page in pages)
+    _, rebuilt = rebuild(pages)
+    assert rebuilt == "".join(pages)
+    assert "mid\n" in rebuilt
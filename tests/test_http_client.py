@@ -0,0 +1,84 @@
+import httpx
+import pytest
+
+import http_client
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+def make_client(statuses, **kwargs):
+    # Answers with the given status codes in turn; records every request.
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = statuses[min(len(requests), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, json={})
+
+    client = HttpClient(backoff=0, **kwargs)
+    client.client = httpx.Client(transport=httpx.MockTransport(handler))
+    return client, requests
+
+
+def test_circuit_breaker_opens_half_opens_and_closes(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, cooldown=10)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] = 10
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()  # one trial call at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+@pytest.mark.parametrize("status", sorted(http_client.RETRY_STATUSES))
+def test_retries_retryable_statuses(status):
+    client, requests = make_client([status, 200], retries=2)
+    assert client.post("http://api.test/x").status_code == 200
+    assert len(requests) == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 501])
+def test_does_not_retry_other_statuses(status):
+    client, requests = make_client([status, 200], retries=2)
+    assert client.post("http://api.test/x").status_code == status
+    assert len(requests) == 1
+
+
+def test_returns_last_response_once_retries_run_out():
+    client, requests = make_client([503], retries=2, breaker_threshold=10)
+    assert client.post("http://api.test/x").status_code == 503
+    assert len(requests) == 3
+
+
+def test_retries_transport_errors_then_raises():
+    client, requests = make_client([httpx.ConnectError("down")], retries=1, breaker_threshold=10)
+    with pytest.raises(httpx.ConnectError):
+        client.post("http://api.test/x")
+    assert len(requests) == 2
+
+
+def test_open_circuit_rejects_calls_per_host():
+    observed = []
+    client, requests = make_client([500], retries=0, breaker_threshold=2,
+                                   observe=lambda url, status, *rest: observed.append(status))
+    for _ in range(2):
+        client.post("http://api.test/x")
+    with pytest.raises(CircuitOpenError):
+        client.post("http://api.test/y")
+    assert len(requests) == 2
+    assert observed == [500, 500, "circuit_open"]
+    client.post("http://other.test/x")  # other hosts have their own breaker
+    assert len(requests) == 3
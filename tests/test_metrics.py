@@ -0,0 +1,68 @@
+import pytest
+
+from metrics import Registry, Tracer
+
+
+def make_tracer():
+    registry = Registry()
+    tracer = Tracer(registry.histogram("stage_seconds", "Stage time", ["stage"]),
+                    registry.counter("stage_errors_total", "Stage errors", ["stage"]))
+    return registry, tracer
+
+
+def failing_pages():
+    yield "page"
+    raise ValueError("bad page")
+
+
+def test_nested_stage_error_is_counted_once():
+    registry, tracer = make_tracer()
+    chunks = tracer.iterate("chunk", tracer.iterate("extract", failing_pages()))
+    with pytest.raises(ValueError) as raised:
+        list(chunks)
+    tracer.error("ingest", raised.value)
+    assert tracer.errors._values == {("extract",): 1}
+    tracer.error("ingest")
+    assert tracer.errors._values == {("extract",): 1, ("ingest",): 1}
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ["endpoint", "status"])
+    histogram = registry.histogram("latency_seconds", "Latency", ["endpoint"], buckets=(0.1, 1.0))
+    registry.collector("cache_entries", "Entries", [], lambda: {(): 3})
+    counter.inc(1, "/chat", 200)
+    counter.inc(2, "/chat", "transport_error")
+    counter.inc(1, 'say "hi"\n', 500)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "/chat")
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{endpoint="/chat",status="200"} 1',
+        'requests_total{endpoint="/chat",status="transport_error"} 2',
+        'requests_total{endpoint="say \\"hi\\"\\n",status="500"} 1',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{endpoint="/chat",le="0.1"} 1',
+        'latency_seconds_bucket{endpoint="/chat",le="1"} 2',
+        'latency_seconds_bucket{endpoint="/chat",le="+Inf"} 3',
+        'latency_seconds_sum{endpoint="/chat"} 5.55',
+        'latency_seconds_count{endpoint="/chat"} 3',
+        "# HELP cache_entries Entries",
+        "# TYPE cache_entries gauge",
+        "cache_entries 3",
+    ]
+
+
+def test_stage_times_exclude_nested_stages():
+    _, tracer = make_tracer()
+    tracer.begin()
+    with tracer.timed("outer"):
+        with tracer.timed("inner"):
+            sum(range(100000))
+    stages = tracer.end()
+    assert set(stages) == {"outer", "inner"}
+    assert stages["outer"] < stages["inner"]
+    assert tracer.histogram._values[("inner",)][-1] == stages["inner"]
@@ -0,0 +1,74 @@
+import app
+
+
+def add_messages(user_uid, n):
+    with app.app.app_context():
+        messages = [app.Message(user_uid=user_uid, text=f"message {i}", sender="user") for i in range(n)]
+        app.db.session.add_all(messages)
+        app.db.session.commit()
+        return [m.id for m in messages]
+
+
+def test_history_pages_newest_first_with_keyset_cursor(login):
+    client, user_uid = login()
+    ids = add_messages(user_uid, 7)
+    add_messages(login()[1], 3)  # another user's messages never show up
+
+    seen, before = [], None
+    while True:
+        query = {"limit": 3} if before is None else {"limit": 3, "before": before}
+        page = client.get("/history", query_string=query).get_json()
+        assert len(page["messages"]) <= 3
+        seen += [m["id"] for m in page["messages"]]
+        before = page["next_before"]
+        if before is None:
+            break
+        assert before == seen[-1]
+    assert seen == ids[::-1]
+
+    # Messages added after the first page don't shift the following pages.
+    first = client.get("/history", query_string={"limit": 3}).get_json()
+    add_messages(user_uid, 2)
+    second = client.get("/history", query_string={"limit": 3, "before": first["next_before"]}).get_json()
+    assert [m["id"] for m in second["messages"]] == ids[::-1][3:6]
+
+
+def test_history_requires_login(database):
+    assert app.app.test_client().get("/history").status_code == 401
+
+
+def add_document(user_uid, filename):
+    with app.app.app_context():
+        doc = app.Document(user_uid=user_uid, filename=filename, content="Full text", preview="Full text",
+                           chunk_count=2, size_bytes=9)
+        app.db.session.add(doc)
+        app.db.session.commit()
+        return doc.id
+
+
+def test_documents_revalidate_with_etag(login, monkeypatch):
+    monkeypatch.setattr(app, "DOCUMENTS_PAGE_SIZE", 2)
+    client, user_uid = login()
+    ids = [add_document(user_uid, f"doc{i}.txt") for i in range(3)]
+
+    response = client.get("/documents")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [d["id"] for d in body["documents"]] == ids[:0:-1]
+    assert body["documents"][0]["content_preview"] == "Full text" and body["documents"][0]["size_bytes"] == 9
+    last = client.get("/documents", query_string={"before": body["next_before"]}).get_json()
+    assert [d["id"] for d in last["documents"]] == ids[:1] and last["next_before"] is None
+
+    etag = response.headers["ETag"]
+    assert client.get("/documents", headers={"If-None-Match": etag}).status_code == 304
+    add_document(user_uid, "new.txt")
+    changed = client.get("/documents", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+def test_metrics_report_requests(login):
+    client, _ = login()
+    client.get("/history").close()  # recorded once the body has been sent
+    text = client.get("/metrics").get_data(as_text=True)
+    assert "# TYPE chatbot_http_request_seconds histogram" in text
+    assert 'chatbot_http_request_seconds_count{endpoint="history",method="GET",status="200"}' in text
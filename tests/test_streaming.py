@@ -0,0 +1,43 @@
+import pytest
+
+from app import StreamingFormatter, clean_ai_response
+
+REPLY = """  ## Summary
+
+**Answer:** The report covers *three* topics:Billing, network and storage.
+
+
+
+- **Billing:**invoices are sent monthly.
+- ***Network:** latency   stays under 20 ms.
+- Storage: snapshots run nightly.
+
+Final words: **all good** and nothing else to add.  """
+
+
+def stream(text, size):
+    formatter = StreamingFormatter()
+    pieces = [formatter.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    return pieces, "".join(pieces) + formatter.finish()
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, 64, len(REPLY)])
+def test_stream_matches_whole_response(size):
+    assert stream(REPLY, size)[1] == clean_ai_response(REPLY)
+
+
+def test_long_paragraph_is_released_before_finish():
+    paragraph = " ".join(["Some **bold** words:", "More text."] * 100)
+    pieces, result = stream(paragraph, 10)
+    assert result == clean_ai_response(paragraph)
+    released = [i for i, piece in enumerate(pieces) if piece]
+    assert released and released[0] < 5
+    assert len(released) > len(pieces) // 2
+
+
+def test_unmatched_bold_is_held_back():
+    formatter = StreamingFormatter()
+    released = formatter.feed("Plain start **Key words ")
+    assert released == "Plain start"
+    released += formatter.feed("here:** Value ")
+    assert released + formatter.finish() == clean_ai_response("Plain start **Key words here:** Value ")
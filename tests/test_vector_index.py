@@ -0,0 +1,87 @@
+import numpy as np
+
+from vector_index import ShardStore, VectorIndex
+
+
+def vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_append_delete_compact_round_trip(tmp_path):
+    store = ShardStore(str(tmp_path))
+    data = vectors(10)
+    assert store.append("u", list(range(1, 11)), data) == list(range(10))
+    # Vectors of the wrong dimension are skipped.
+    assert store.append("u", [11, 12], [vectors(1, 4)[0], data[0]]) == [None, 10]
+
+    shard = store.open("u")
+    assert shard.ids.tolist() == list(range(1, 11)) + [12]
+    np.testing.assert_allclose(np.linalg.norm(shard.matrix, axis=1), 1, rtol=1e-6)
+
+    assert store.delete("u", [3, 12, 99], [2, None, None]) == (2, 9)
+    shard = store.open("u")
+    assert shard.ids[2] == -1 and np.isnan(shard.matrix[2]).all()
+
+    rows = store.compact("u")
+    assert rows == {id: row for row, id in enumerate([1, 2, 4, 5, 6, 7, 8, 9, 10])}
+    shard = store.open("u")
+    assert shard.ids.tolist() == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    expected = data[[0, 1, 3, 4, 5, 6, 7, 8, 9]]
+    np.testing.assert_allclose(shard.matrix, expected / np.linalg.norm(expected, axis=1, keepdims=True),
+                               rtol=1e-6)
+    # Appends continue after the compacted rows.
+    assert store.append("u", [13], vectors(1, seed=1)) == [9]
+
+
+def test_search_follows_deletes_and_compaction(tmp_path):
+    store = ShardStore(str(tmp_path))
+    index = VectorIndex(store, max_bytes=1 << 20)
+    data = vectors(20)
+    store.append("u", list(range(100, 120)), data)
+    assert index.search("u", data[5], 1)[0][0] == 105
+
+    store.delete("u", [105])
+    assert 105 not in [id for id, _ in index.search("u", data[5], 20)]
+
+    store.compact("u")
+    results = index.search("u", data[7], 3)
+    assert results[0][0] == 107 and abs(results[0][1] - 1) < 1e-5
+    assert len(index.search("u", data[7], 50)) == 19
+
+    store.remove("u")
+    assert index.search("u", data[7], 3) == []
+
+
+def wait_for_ann(index, user_uid, query):
+    index.search(user_uid, query, 1)
+    index._builder.submit(lambda: None).result()
+
+
+def test_ann_index_is_not_reused_after_compaction(tmp_path):
+    store = ShardStore(str(tmp_path))
+    data = vectors(400, dim=16)
+    store.append("u", list(range(400)), data)
+    index = VectorIndex(store, max_bytes=1 << 20, ann_threshold=100, ann_nlist=8)
+    wait_for_ann(index, "u", data[0])
+    assert index.search("u", data[3], 1)[0][0] == 3
+
+    # Restart, then shrink the shard over two compactions (which may hand
+    # the file its old inode back) without searching in between.
+    index = VectorIndex(store, max_bytes=1 << 20, ann_threshold=100, ann_nlist=8)
+    for ids in (range(0, 100), range(100, 250)):
+        store.delete("u", list(ids))
+        store.compact("u")
+    wait_for_ann(index, "u", data[300])
+    for id in (260, 300, 399):
+        assert index.search("u", data[id], 1)[0][0] == id
+
+
+def test_search_returns_each_id_once(tmp_path):
+    store = ShardStore(str(tmp_path))
+    data = vectors(3)
+    # As left by older versions when a crash came between append and commit.
+    store.append("u", [1, 2, 3], data)
+    store.append("u", [1, 2, 3], data)
+    index = VectorIndex(store, max_bytes=1 << 20)
+    ids = [id for id, _ in index.search("u", data[0], 6)]
+    assert ids[0] == 1 and sorted(ids) == [1, 2, 3]
@@ -0,0 +1,389 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from ann import IVFIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server only
+    fcntl = None
+
+MAGIC = b"VSHD"
+HEADER_SIZE = 16
+DEAD = -1
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1)
+    keep = norms > 0
+    out = np.zeros_like(vectors)
+    out[keep] = vectors[keep] / norms[keep, None]
+    return out
+
+
+def record_dtype(dim):
+    return np.dtype([("id", "<i8"), ("vec", "<f4", (dim,))])
+
+
+class ShardStore:
+    # Per-user append-only vector shards stored next to the database.
+    #
+    # Each shard is a 16-byte header (magic + uint32 dim + uint64 generation)
+    # followed by fixed-size records of (int64 embedding id, float32[dim] unit
+    # vector). Rows are never moved except by `compact`, which gives the shard
+    # a new generation (unique across re-creations of the file too, unlike
+    # its inode); deleted rows are tombstoned in place
+    # (id = -1, vector = NaN) so every process that has the file mapped sees
+    # the delete immediately through the shared page cache.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, user_uid):
+        key = hashlib.sha1(user_uid.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.directory, key + ".vec")
+
+    @contextmanager
+    def _locked(self, user_uid):
+        with open(self.path(user_uid) + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def header(dim, generation):
+        return MAGIC + np.array([dim], dtype="<u4").tobytes() + np.array([generation], dtype="<u8").tobytes()
+
+    @staticmethod
+    def read_header(f):
+        """Returns (dim, generation), or None if the file is not a shard."""
+        f.seek(0)
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:4] != MAGIC:
+            return None
+        return (int(np.frombuffer(header, dtype="<u4", count=1, offset=4)[0]),
+                int(np.frombuffer(header, dtype="<u8", count=1, offset=8)[0]))
+
+    @classmethod
+    def read_dim(cls, f):
+        header = cls.read_header(f)
+        return header and header[0]
+
+    def append(self, user_uid, ids, vectors):
+        """Append vectors and return their row numbers (None where the
+        vector's dimension does not match the shard)."""
+        vectors = [np.asarray(v, dtype=np.float32).ravel() for v in vectors]
+        if not vectors:
+            return []
+        path = self.path(user_uid)
+        with self._locked(user_uid):
+            with open(path, "a+b") as f:
+                dim = self.read_dim(f)
+                if dim is None:
+                    dim = vectors[0].size
+                    f.truncate(0)
+                    f.write(self.header(dim, time.time_ns()))
+                dtype = record_dtype(dim)
+                # Drop a torn record left behind by a crashed writer.
+                size = f.seek(0, os.SEEK_END)
+                count = (size - HEADER_SIZE) // dtype.itemsize
+                f.truncate(HEADER_SIZE + count * dtype.itemsize)
+
+                keep = [i for i, v in enumerate(vectors) if v.size == dim]
+                records = np.zeros(len(keep), dtype=dtype)
+                records["id"] = [ids[i] for i in keep]
+                if keep:
+                    records["vec"] = normalize_rows(np.stack([vectors[i] for i in keep]))
+                f.seek(0, os.SEEK_END)
+                f.write(records.tobytes())
+
+        rows = [None] * len(vectors)
+        for n, i in enumerate(keep):
+            rows[i] = count + n
+        return rows
+
+    def delete(self, user_uid, ids, rows=None):
+        """Tombstone the given embedding ids and return (dead, live) row
+        counts. `rows` are the expected row numbers; stale hints are resolved
+        by scanning the id column."""
+        path = self.path(user_uid)
+        if not ids or not os.path.exists(path):
+            return 0, 0
+        with self._locked(user_uid):
+            with open(path, "r+b") as f:
+                dim = self.read_dim(f)
+                size = f.seek(0, os.SEEK_END)
+                if dim is None:
+                    return 0, 0
+                dtype = record_dtype(dim)
+                count = (size - HEADER_SIZE) // dtype.itemsize
+                if count <= 0:
+                    return 0, 0
+                records = np.memmap(f, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=(count,))
+                wanted = np.asarray(ids, dtype=np.int64)
+                hints = np.asarray([-1 if r is None else r for r in (rows or [None] * len(ids))], dtype=np.int64)
+                valid = (hints >= 0) & (hints < len(records))
+                valid[valid] = records["id"][hints[valid]] == wanted[valid]
+                targets = hints[valid]
+                if not valid.all():
+                    missing = np.flatnonzero(np.isin(records["id"], wanted[~valid]))
+                    targets = np.concatenate([targets, missing])
+                records["id"][targets] = DEAD
+                records["vec"][targets] = np.nan
+                records.flush()
+                dead = int(np.count_nonzero(records["id"] == DEAD))
+                live = len(records) - dead
+                del records
+        return dead, live
+
+    def compact(self, user_uid):
+        """Rewrite the shard without tombstones. Returns {id: new_row}."""
+        path = self.path(user_uid)
+        with self._locked(user_uid):
+            with open(path, "rb") as f:
+                header = self.read_header(f)
+                if header is None:
+                    return {}
+                dim, generation = header
+                records = np.fromfile(f, dtype=record_dtype(dim))
+            records = records[records["id"] != DEAD]
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.header(dim, max(generation + 1, time.time_ns())))
+                f.write(records.tobytes())
+            # Readers holding the old mapping keep a valid (unlinked) file and
+            # reopen when they notice the signature changed.
+            os.replace(tmp, path)
+            # Its row numbers are no longer valid.
+            try:
+                os.remove(self.ann_path(user_uid))
+            except FileNotFoundError:
+                pass
+        return {int(id): row for row, id in enumerate(records["id"])}
+
+    def remove(self, user_uid):
+        with self._locked(user_uid):
+            for path in (self.path(user_uid), self.ann_path(user_uid)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def ann_path(self, user_uid):
+        return self.path(user_uid) + ".ivf.npz"
+
+    def open(self, user_uid):
+        path = self.path(user_uid)
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                header = self.read_header(f)
+        except FileNotFoundError:
+            return None
+        if header is None:
+            return None
+        dim, generation = header
+        dtype = record_dtype(dim)
+        count = (stat.st_size - HEADER_SIZE) // dtype.itemsize
+        if count <= 0:
+            return None
+        records = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+        return MappedShard((stat.st_ino, stat.st_size, stat.st_mtime_ns), records, generation)
+
+    def version(self, user_uid):
+        # Changes on every append, tombstone, compaction and removal.
+        try:
+            stat = os.stat(self.path(user_uid))
+        except FileNotFoundError:
+            return "empty"
+        return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+    def signature(self, user_uid):
+        try:
+            stat = os.stat(self.path(user_uid))
+        except FileNotFoundError:
+            return None
+        # The inode alone can come back after two compactions.
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class MappedShard:
+    def __init__(self, signature, records, generation=0):
+        self.signature = signature
+        self.generation = generation
+        self.records = records
+        self.ids = records["id"]
+        self.matrix = records["vec"]
+        self.dim = self.matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def candidate_rows(self, candidates):
+        # candidates: [(embedding_id, expected_row)]; rows that moved (e.g.
+        # after a compaction) are looked up by id instead.
+        ids = np.asarray([id for id, _ in candidates], dtype=np.int64)
+        rows = np.asarray([-1 if row is None else row for _, row in candidates], dtype=np.int64)
+        valid = (rows >= 0) & (rows < len(self.ids))
+        valid[valid] = self.ids[rows[valid]] == ids[valid]
+        if not valid.all():
+            rows = np.concatenate([rows[valid], np.flatnonzero(np.isin(self.ids, ids[~valid]))])
+        return rows
+
+    def top_k(self, query, k, candidates=None, ann=None, stats=None):
+        if query.size != self.dim:
+            return []
+        if candidates is None and ann is not None:
+            rows, scores, scored = ann.search(self.matrix, query, k)
+        elif candidates is None:
+            rows = None
+            scores = self.matrix @ query
+            scored = len(scores)
+        else:
+            rows = self.candidate_rows(candidates)
+            scores = self.matrix[rows] @ query
+            scored = len(scores)
+        if stats is not None:
+            stats["scored"] = scored
+        scores = np.nan_to_num(scores, nan=-np.inf)
+        if len(scores) > k:
+            idx = np.argpartition(-scores, k)[:k]
+        else:
+            idx = np.arange(len(scores))
+        idx = idx[np.argsort(-scores[idx])]
+        ids = self.ids if rows is None else self.ids[rows]
+        return [(int(ids[i]), float(scores[i])) for i in idx
+                if ids[i] != DEAD and np.isfinite(scores[i])]
+
+
+class VectorIndex:
+    # In-process view over the shard files. Each user's shard is memory-mapped
+    # read-only, so every worker process shares one copy of the vectors in the
+    # page cache. A cheap stat() on each search picks up appends, compactions
+    # and removals made by other workers. Mappings are evicted
+    # least-recently-used once their combined size goes over `max_bytes`.
+    #
+    # Shards with at least `ann_threshold` rows (0 disables) are searched
+    # through an IVF index instead of a full scan. The index is trained on a
+    # background thread, saved next to the shard for the other workers, and
+    # retrained once the rows appended since training exceed `ann_retrain`
+    # times the trained rows or a compaction moves rows around. Until it is
+    # ready searches stay exact.
+    def __init__(self, store, max_bytes, ann_threshold=0, ann_nlist=0, ann_nprobe=8,
+                 ann_pq_m=0, ann_retrain=0.5):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ann_threshold = ann_threshold
+        self.ann_nlist = ann_nlist
+        self.ann_nprobe = ann_nprobe
+        self.ann_pq_m = ann_pq_m
+        self.ann_retrain = ann_retrain
+        self._users = OrderedDict()
+        self._anns = {}  # user_uid -> (shard generation, IVFIndex)
+        self._building = set()
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann")
+        self._lock = threading.RLock()
+
+    def _get(self, user_uid):
+        signature = self.store.signature(user_uid)
+        entry = self._users.get(user_uid)
+        if entry is not None and entry.signature == signature:
+            self._users.move_to_end(user_uid)
+            return entry
+        self._users.pop(user_uid, None)
+        if signature is None:
+            return None
+        entry = self.store.open(user_uid)
+        if entry is None:
+            return None
+        self._users[user_uid] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._users.values())
+        while total > self.max_bytes and len(self._users) > 1:
+            user_uid, entry = self._users.popitem(last=False)
+            self._anns.pop(user_uid, None)
+            total -= entry.nbytes
+
+    def _stale(self, ann, generation, count):
+        return (ann is None or ann[0] != generation or ann[1].trained > count
+                or count - ann[1].trained > self.ann_retrain * ann[1].trained)
+
+    def _ann(self, user_uid, entry):
+        # Called with the lock held. Returns the usable index, if any, and
+        # schedules a (re)build when it is missing or out of date.
+        count = len(entry.ids)
+        if not self.ann_threshold or count < self.ann_threshold:
+            return None
+        ann = self._anns.get(user_uid)
+        if self._stale(ann, entry.generation, count) and user_uid not in self._building:
+            self._building.add(user_uid)
+            self._builder.submit(self._build, user_uid)
+        usable = ann is not None and ann[0] == entry.generation and ann[1].trained <= count
+        return ann[1] if usable else None
+
+    def _build(self, user_uid):
+        try:
+            entry = self.store.open(user_uid)
+            if entry is None:
+                return
+            generation, count = entry.generation, len(entry.ids)
+            path = self.store.ann_path(user_uid)
+            # Another worker may already have trained on this shard.
+            tag = f"generation-{generation}"
+            index = IVFIndex.load(path, tag)
+            if index is None or self._stale((generation, index), generation, count):
+                nlist = self.ann_nlist or int(4 * np.sqrt(count))
+                index = IVFIndex(nlist, self.ann_nprobe, self.ann_pq_m).train(entry.matrix)
+                index.save(path, tag)
+            with self._lock:
+                self._anns[user_uid] = (generation, index)
+        except Exception as e:
+            print(f"ANN index build failed for {user_uid}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(user_uid)
+
+    def search(self, user_uid, query, k, candidates=None, stats=None):
+        """Top-k (embedding_id, cosine) pairs, optionally scoring only the
+        given (embedding_id, shard_row) candidates. `stats`, if given, gets
+        the number of rows scored."""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        with self._lock:
+            entry = self._get(user_uid)
+            if entry is None:
+                return []
+            ann = self._ann(user_uid, entry) if candidates is None else None
+        # Shards written before embedding ids were committed first can hold
+        # an id twice; keep its best match.
+        hits, seen = [], set()
+        for id, score in entry.top_k(query / norm, k, candidates, ann, stats):
+            if id not in seen:
+                seen.add(id)
+                hits.append((id, score))
+        return hits
+
+    def drop(self, user_uid):
+        with self._lock:
+            self._users.pop(user_uid, None)
+            self._anns.pop(user_uid, None)